@@ -10,14 +10,26 @@ import uuid
 import time
 import asyncio
 import logging
-import subprocess
-import threading
-import json
 import re
+import shutil
+import hashlib
+import functools
+import itertools
+import operator
+import orjson
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Optional, Dict, Any, List
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, Deque, Tuple, Callable, Set
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+import httpx
+
+try:
+    import uvloop
+except ImportError:  # Windows / minimal installs fall back to asyncio
+    uvloop = None
 
 load_dotenv()  # Load environment variables from .env file
 
@@ -29,6 +41,7 @@ from fastapi import (
     status,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, SecretStr
 
 # ── OpenHands SDK V1 Imports ────────────────────────────────
@@ -84,20 +97,25 @@ MODEL_CONFIGS = {
     "google": {
         "model": "gemini/gemini-3-flash-preview",
         "env_key": "GOOGLE_API_KEY",
+        "default_key": GOOGLE_API_KEY,
         "label": "Gemini 3 Flash Preview",
     },
     "anthropic": {
         "model": "anthropic/claude-3-5-sonnet-20241022",
         "env_key": "ANTHROPIC_API_KEY",
+        "default_key": ANTHROPIC_API_KEY,
         "label": "Claude 3.5 Sonnet",
     },
 }
 DEFAULT_PROVIDER = os.getenv("DEFAULT_MODEL_PROVIDER", "anthropic")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "32"))
 
 # Agent Config
 MAX_ITERATIONS = int(os.getenv("MAX_ITERATIONS", "50"))
 AGENT_SERVER_PORT = int(os.getenv("AGENT_SERVER_PORT", "8001"))
 AGENT_SERVER_HOST = os.getenv("AGENT_SERVER_HOST", "127.0.0.1")
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "4096"))  # per session
+MAX_CONCURRENT_AGENTS = int(os.getenv("MAX_CONCURRENT_AGENTS", "16"))
 
 # Sandbox Config
 SANDBOX_IMAGE = os.getenv(
@@ -105,6 +123,9 @@ SANDBOX_IMAGE = os.getenv(
     "nikolaik/python-nodejs:python3.11-nodejs20"
 )
 WORKSPACE_MOUNT_PATH = os.getenv("WORKSPACE_MOUNT_PATH", "/workspace")
+LOCAL_WORKSPACE_BASE = os.getenv("LOCAL_WORKSPACE_BASE", "/tmp/lucid_workspace")
+FILE_TREE_CACHE_TTL = float(os.getenv("FILE_TREE_CACHE_TTL", "2.0"))  # seconds
+FILE_TREE_MAX_ENTRIES = int(os.getenv("FILE_TREE_MAX_ENTRIES", "50000"))
 
 # Server Config
 SESSION_SECRET = os.getenv("SESSION_SECRET", "change_me_in_prod")
@@ -145,6 +166,7 @@ class AgentSession:
         self.task = task
         self.repo_url = repo_url
         self.created_at = datetime.now(timezone.utc)
+        self.created_at_iso = self.created_at.isoformat()  # immutable — format once
         self.is_alive = True
 
         # SDK objects — set during initialization
@@ -153,13 +175,59 @@ class AgentSession:
         self.agent: Optional[Any] = None
         self.llm: Optional[Any] = None
 
-        # Event buffer for WebSocket streaming
-        self.event_buffer: asyncio.Queue = asyncio.Queue()
+        # Event buffer for WebSocket streaming. SDK callbacks append
+        # from worker threads (oldest events fall off when full) and
+        # wake the writer task on the loop via `event_ready`.
+        self.event_buffer: Deque[dict] = deque(maxlen=EVENT_BUFFER_SIZE)
+        self.event_ready = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        # Monotonic per-session event sequence; gaps mark dropped events
+        self.seq = itertools.count()
+
+        # Last scanned file tree: (monotonic timestamp, tree)
+        self.tree_cache: Optional[Tuple[float, List[dict]]] = None
+        # Debounced file_tree push (see _schedule_tree_refresh)
+        self.tree_dirty = False
+        self.tree_refresh_task: Optional[asyncio.Task] = None
+        # Hash of the last file_tree sent over the WebSocket
+        self.last_tree_hash = 0
+
+    def push_event(self, event):
+        """
+        SDK callback for every event (actions, observations, state
+        changes). Formats it and buffers it for the WebSocket writer;
+        safe to call from the SDK's worker threads.
+        """
+        try:
+            event_data = _format_sdk_event(event)
+            if event_data:
+                event_data["seq"] = next(self.seq)
+                self.event_buffer.append(event_data)
+                self.loop.call_soon_threadsafe(self.event_ready.set)
+        except Exception as e:
+            logger.error(f"Event callback error: {e}")
 
 
 # Global store: session_id → AgentSession
+# No lock: inserts and the teardown pop are single dict operations
+# with no await in between, so coroutines cannot interleave them.
 active_sessions: Dict[str, AgentSession] = {}
-_session_lock = asyncio.Lock()
+
+# LRU of built LLMs: (provider, api-key digest) → LLM
+_llm_cache: "OrderedDict[tuple, Any]" = OrderedDict()
+
+# Dedicated thread pools. Agent runs block a thread for minutes, so
+# they get their own pool instead of the shared default executor —
+# otherwise a few busy agents starve the short workspace calls
+# (file reads, tree scans) that the UI is waiting on.
+_AGENT_EXECUTOR = ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_AGENTS, thread_name_prefix="agent-run"
+)
+_FS_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fs")
+
+# Workspace removals still running on _FS_EXECUTOR — awaited on
+# shutdown so they can't be dropped (workspaces live on a volume)
+_workspace_cleanups: Set["asyncio.Future"] = set()
 
 
 # ═══════════════════════════════════════════════════════════
@@ -174,7 +242,8 @@ class ManagedAgentServer:
     execution via RemoteWorkspace/RemoteConversation.
 
     In production, this would be a separate service (K8s pod, etc.).
-    For local dev, we manage it as a subprocess.
+    For local dev, we manage it as an asyncio subprocess whose merged
+    stdout/stderr is relayed by a single reader task on the loop.
     """
 
     def __init__(
@@ -184,24 +253,45 @@ class ManagedAgentServer:
     ):
         self.port = port
         self.host = host
-        self.process: Optional[subprocess.Popen] = None
+        self.process: Optional[asyncio.subprocess.Process] = None
         self.base_url = f"http://{host}:{port}"
-        self._stdout_thread: Optional[threading.Thread] = None
-        self._stderr_thread: Optional[threading.Thread] = None
-
-    def _stream_output(self, stream, prefix, target_stream):
-        """Relay subprocess output to our logs."""
+        self._pump_task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def is_running(self) -> bool:
+        """True while the subprocess has been started and not exited."""
+        return self.process is not None and self.process.returncode is None
+
+    _PREFIX = b"[AGENT-SERVER] "
+    _NL_PREFIX = b"\n" + _PREFIX
+
+    async def _pump(self, stream: asyncio.StreamReader):
+        """
+        Relay subprocess output to our stdout in raw chunks.
+        Lines are prefixed with a single bytes.replace per chunk —
+        no per-line decoding or string formatting.
+        """
+        out = sys.stdout.buffer
+        at_line_start = True
         try:
-            for line in iter(stream.readline, ""):
-                if line:
-                    target_stream.write(f"[{prefix}] {line}")
-                    target_stream.flush()
+            while True:
+                chunk = await stream.read(65536)
+                if not chunk:
+                    break
+                if at_line_start:
+                    out.write(self._PREFIX)
+                # A trailing newline's prefix is deferred to the next chunk
+                out.write(chunk[:-1].replace(b"\n", self._NL_PREFIX))
+                out.write(chunk[-1:])
+                out.flush()
+                at_line_start = chunk.endswith(b"\n")
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
-            logger.error(f"Error streaming {prefix}: {e}")
-        finally:
-            stream.close()
+            logger.error(f"Error streaming AGENT-SERVER output: {e}")
 
-    def start(self) -> bool:
+    async def start(self) -> bool:
         """Start the agent server subprocess."""
         if not OPENHANDS_AVAILABLE:
             logger.warning("OpenHands SDK not available — skipping agent server")
@@ -210,60 +300,48 @@ class ManagedAgentServer:
         logger.info(f"🚀 Starting OpenHands Agent Server on {self.base_url}...")
 
         try:
-            self.process = subprocess.Popen(
-                [
-                    sys.executable,
-                    "-m",
-                    "openhands.agent_server",
-                    "--port",
-                    str(self.port),
-                    "--host",
-                    self.host,
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                "openhands.agent_server",
+                "--port",
+                str(self.port),
+                "--host",
+                self.host,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
                 env={"LOG_JSON": "true", **os.environ},
             )
 
             # Stream server output
-            self._stdout_thread = threading.Thread(
-                target=self._stream_output,
-                args=(self.process.stdout, "AGENT-SERVER", sys.stdout),
-                daemon=True,
-            )
-            self._stderr_thread = threading.Thread(
-                target=self._stream_output,
-                args=(self.process.stderr, "AGENT-SERVER", sys.stderr),
-                daemon=True,
+            self._pump_task = asyncio.create_task(
+                self._pump(self.process.stdout)
             )
-            self._stdout_thread.start()
-            self._stderr_thread.start()
 
-            # Wait for server readiness
+            # Wait for server readiness (one pooled keep-alive client)
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(1.0),
+            )
             max_retries = 30
             for i in range(max_retries):
                 try:
-                    import httpx
-
-                    response = httpx.get(
-                        f"{self.base_url}/health", timeout=1.0
-                    )
+                    response = await self._client.get("/health")
                     if response.status_code == 200:
                         logger.info(
                             f"✅ Agent Server ready at {self.base_url}"
                         )
                         return True
-                except Exception:
+                except httpx.HTTPError:
                     pass
 
-                if self.process.poll() is not None:
+                if self.process.returncode is not None:
                     logger.error(
                         "❌ Agent Server terminated unexpectedly"
                     )
                     return False
 
-                time.sleep(1)
+                await asyncio.sleep(1)
 
             logger.error(
                 f"❌ Agent Server failed to start after {max_retries}s"
@@ -274,18 +352,24 @@ class ManagedAgentServer:
             logger.error(f"❌ Failed to start Agent Server: {e}")
             return False
 
-    def stop(self):
+    async def stop(self):
         """Stop the agent server subprocess."""
         if self.process:
             logger.info("🛑 Stopping Agent Server...")
-            self.process.terminate()
-            try:
-                self.process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                logger.warning("⚠️  Force-killing Agent Server...")
-                self.process.kill()
-                self.process.wait()
-            time.sleep(0.5)
+            if self.process.returncode is None:
+                self.process.terminate()
+                try:
+                    await asyncio.wait_for(self.process.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    logger.warning("⚠️  Force-killing Agent Server...")
+                    self.process.kill()
+                    await self.process.wait()
+            if self._pump_task:
+                self._pump_task.cancel()
+            if self._client:
+                await self._client.aclose()
+                self._client = None
+            await asyncio.sleep(0.5)
             logger.info("✅ Agent Server stopped.")
 
 
@@ -305,10 +389,15 @@ async def lifespan(app: FastAPI):
     and clean up all sessions + server on shutdown.
     """
     logger.info("🚀 Lucid AI Engine starting...")
+    logger.info(f"🔁 Event loop: {type(asyncio.get_running_loop()).__name__}")
+
+    # Parent of all local (dev-mode) workspaces — created once here so
+    # each session only needs a single mkdir
+    os.makedirs(LOCAL_WORKSPACE_BASE, exist_ok=True)
 
     # Start the sandboxed agent server (non-blocking)
     if OPENHANDS_AVAILABLE and LLM_API_KEY:
-        server_started = await asyncio.to_thread(_agent_server.start)
+        server_started = await _agent_server.start()
         if server_started:
             logger.info("✅ Agent Server subprocess is running")
         else:
@@ -331,7 +420,12 @@ async def lifespan(app: FastAPI):
         await _destroy_session(session_id)
 
     # Stop agent server
-    await asyncio.to_thread(_agent_server.stop)
+    await _agent_server.stop()
+    if _workspace_cleanups:
+        await asyncio.gather(*_workspace_cleanups, return_exceptions=True)
+    _AGENT_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    # Let queued workspace I/O finish without blocking the loop
+    await asyncio.to_thread(_FS_EXECUTOR.shutdown)
     logger.info("✅ All resources cleaned up.")
 
 
@@ -339,6 +433,11 @@ async def lifespan(app: FastAPI):
 #  FastAPI App
 # ═══════════════════════════════════════════════════════════
 
+# libuv-backed event loop — cheaper socket I/O and task scheduling
+# for the WebSocket streaming workload.
+if uvloop is not None and sys.platform != "win32":
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
 app = FastAPI(
     title="Lucid AI Engine",
     description=(
@@ -348,6 +447,7 @@ app = FastAPI(
     ),
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -373,7 +473,7 @@ class InitSessionRequest(BaseModel):
     task: str                              # The task for the agent
     projectId: Optional[str] = None        # Optional project context
     model_provider: Optional[str] = None   # "google" | "anthropic"
-    api_key: Optional[str] = None          # User's own API key (optional)
+    api_key: Optional[SecretStr] = None    # User's own API key (optional)
 
 
 class InitSessionResponse(BaseModel):
@@ -396,20 +496,23 @@ class SessionStatus(BaseModel):
 # ═══════════════════════════════════════════════════════════
 
 
+# Fields of the health payload that never change after import
+_STATIC_HEALTH = MappingProxyType({
+    "service": "Lucid AI Engine",
+    "version": "1.0.0",
+    "status": "healthy",
+    "openhands_available": OPENHANDS_AVAILABLE,
+    "llm_model": MODEL_CONFIGS.get(DEFAULT_PROVIDER, {}).get("model", "unknown"),
+})
+
+
 @app.get("/")
 def health_check():
     """Health check with system status."""
     return {
-        "service": "Lucid AI Engine",
-        "version": "1.0.0",
-        "status": "healthy",
-        "openhands_available": OPENHANDS_AVAILABLE,
-        "agent_server_running": (
-            _agent_server.process is not None
-            and _agent_server.process.poll() is None
-        ),
+        **_STATIC_HEALTH,
+        "agent_server_running": _agent_server.is_running,
         "active_sessions": len(active_sessions),
-        "llm_model": MODEL_CONFIGS.get(DEFAULT_PROVIDER, {}).get("model", "unknown"),
     }
 
 
@@ -428,7 +531,7 @@ async def list_sessions():
                 "userId": s.user_id,
                 "task": s.task[:80],
                 "isAlive": s.is_alive,
-                "createdAt": s.created_at.isoformat(),
+                "createdAt": s.created_at_iso,
             }
             for s in active_sessions.values()
         ]
@@ -474,10 +577,7 @@ async def init_session(payload: InitSessionRequest):
         # ── 3. Create Workspace ───────────────────────────
         # If agent server is running → RemoteWorkspace (Docker sandbox)
         # Otherwise → LocalWorkspace (in-process, for dev)
-        agent_server_alive = (
-            _agent_server.process is not None
-            and _agent_server.process.poll() is None
-        )
+        agent_server_alive = _agent_server.is_running
 
         if agent_server_alive:
             # Production: Docker-sandboxed via agent-server
@@ -489,24 +589,15 @@ async def init_session(payload: InitSessionRequest):
 
             # Clone repo into sandbox if provided
             if payload.repoUrl:
-                clone_url = payload.repoUrl
-                if payload.gitToken:
-                    if "github.com" in clone_url:
-                        clone_url = clone_url.replace(
-                            "https://",
-                            f"https://x-access-token:{payload.gitToken}@",
-                        )
-                    elif "gitlab" in clone_url:
-                        clone_url = clone_url.replace(
-                            "https://",
-                            f"https://oauth2:{payload.gitToken}@",
-                        )
-
-                # Build clone command with optional branch
-                branch_flag = f" -b {payload.branch}" if payload.branch else ""
-                clone_cmd = f"git clone --depth 1{branch_flag} {clone_url} {WORKSPACE_MOUNT_PATH}/repo"
+                clone_cmd = _build_clone_cmd(
+                    _inject_git_credentials(payload.repoUrl, payload.gitToken),
+                    payload.branch,
+                )
 
-                result = workspace.execute_command(clone_cmd)
+                result = await asyncio.to_thread(
+                    workspace.execute_command,
+                    clone_cmd,
+                )
                 if result.exit_code != 0:
                     logger.warning(
                         f"⚠️  Git clone failed: {result.stdout}"
@@ -516,8 +607,8 @@ async def init_session(payload: InitSessionRequest):
                     logger.info(f"✅ Cloned repository '{payload.repoUrl}'{branch_info}")
         else:
             # Dev mode: local filesystem workspace
-            workspace_dir = f"/tmp/lucid_workspace/{session_id}"
-            os.makedirs(workspace_dir, exist_ok=True)
+            workspace_dir = f"{LOCAL_WORKSPACE_BASE}/{session_id}"
+            _make_workspace_dir(workspace_dir)
             workspace = workspace_dir
             logger.info(f"📁 Using LocalWorkspace at {workspace_dir}")
 
@@ -532,35 +623,17 @@ async def init_session(payload: InitSessionRequest):
         session.agent = agent
         session.workspace = workspace
 
-        # Define the event callback — pushes events into the buffer
-        def on_event(event):
-            """
-            Called by the SDK for every event (actions, observations,
-            state changes). We push them into an asyncio queue so the
-            WebSocket handler can stream them to the frontend.
-            """
-            try:
-                event_data = _format_sdk_event(event)
-                if event_data:
-                    # Use call_soon_threadsafe for thread-safe queue put
-                    try:
-                        session.event_buffer.put_nowait(event_data)
-                    except asyncio.QueueFull:
-                        pass  # Drop oldest if buffer full
-            except Exception as e:
-                logger.error(f"Event callback error: {e}")
-
-        conversation = Conversation(
+        conversation = await asyncio.to_thread(
+            Conversation,
             agent=agent,
             workspace=workspace,
-            callbacks=[on_event],
+            callbacks=[session.push_event],
         )
 
         session.conversation = conversation
 
         # ── 5. Store session ──────────────────────────────
-        async with _session_lock:
-            active_sessions[session_id] = session
+        active_sessions[session_id] = session
 
         logger.info(
             f"✅ Session {session_id} created — "
@@ -639,7 +712,8 @@ async def read_file(session_id: str, path: str):
       - session_id: The active agent session ID
       - path: Absolute path to the file inside the workspace
 
-    Returns: { "content": "..." }
+    Returns: the raw file content as text/plain (streamed in chunks
+    for local workspaces).
     """
     session = active_sessions.get(session_id)
     if not session:
@@ -666,12 +740,17 @@ async def read_file(session_id: str, path: str):
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"File not found: {path}",
                 )
-            with open(full_path, "r", errors="replace") as f:
-                content = f.read()
+            # Sync generator → Starlette iterates it in the threadpool,
+            # so large files never block the loop or sit in memory.
+            return StreamingResponse(
+                _iter_file_chunks(full_path),
+                media_type="text/plain; charset=utf-8",
+            )
         else:
             # Remote workspace (Docker sandbox)
             safe_path = path.replace('"', '\\"')
-            result = await asyncio.to_thread(
+            result = await asyncio.get_running_loop().run_in_executor(
+                _FS_EXECUTOR,
                 workspace.execute_command,
                 f'cat "{safe_path}"',
             )
@@ -681,8 +760,7 @@ async def read_file(session_id: str, path: str):
                     detail=f"File not found or unreadable: {path}",
                 )
             content = result.stdout if hasattr(result, 'stdout') else str(result)
-
-        return {"content": content}
+            return PlainTextResponse(content)
 
     except HTTPException:
         raise
@@ -711,8 +789,14 @@ async def list_files_endpoint(session_id: str):
             detail=f"Session {session_id} not found.",
         )
 
+    # Rapid re-renders share one scan
+    now = time.monotonic()
+    if session.tree_cache and now - session.tree_cache[0] < FILE_TREE_CACHE_TTL:
+        return {"tree": session.tree_cache[1]}
+
     try:
         tree = await _list_files_in_workspace(session)
+        session.tree_cache = (now, tree)
         return {"tree": tree}
     except Exception as e:
         logger.error(f"❌ list_files error: {e}", exc_info=True)
@@ -722,6 +806,13 @@ async def list_files_endpoint(session_id: str):
         )
 
 
+def _iter_file_chunks(path: str, chunk_size: int = 64 * 1024):
+    """Yield a file's bytes in fixed-size chunks."""
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
 # ═══════════════════════════════════════════════════════════
 #  WebSocket /ws
 # ═══════════════════════════════════════════════════════════
@@ -758,7 +849,7 @@ async def websocket_agent(websocket: WebSocket):
     try:
         # ── Step 1: Receive initial config ────────────────
         raw = await asyncio.wait_for(
-            websocket.receive_json(), timeout=30.0
+            _recv(websocket), timeout=30.0
         )
 
         token = raw.get("token", "")
@@ -767,17 +858,18 @@ async def websocket_agent(websocket: WebSocket):
         task = raw.get("task", "")
         project_id = raw.get("projectId", "")
         model_provider = raw.get("modelProvider", raw.get("model_provider", DEFAULT_PROVIDER))
-        user_api_key = raw.get("apiKey", raw.get("api_key", ""))
+        raw_api_key = raw.get("apiKey") or raw.get("api_key")
+        user_api_key = SecretStr(raw_api_key) if raw_api_key else None
 
         if not task:
-            await websocket.send_json({
+            await _send(websocket, {
                 "type": "error",
                 "message": "Missing required field: 'task'",
             })
             await websocket.close(code=4001, reason="Missing task")
             return
 
-        await websocket.send_json({
+        await _send(websocket, {
             "type": "status",
             "status": "initializing",
             "message": "Setting up agent workspace...",
@@ -795,7 +887,7 @@ async def websocket_agent(websocket: WebSocket):
             )
             active_sessions[session_id] = session
 
-            await websocket.send_json({
+            await _send(websocket, {
                 "type": "status",
                 "status": "mock_mode",
                 "sessionId": session_id,
@@ -815,7 +907,7 @@ async def websocket_agent(websocket: WebSocket):
         try:
             llm = _resolve_llm(provider, user_api_key)
         except ValueError as e:
-            await websocket.send_json({
+            await _send(websocket, {
                 "type": "error",
                 "message": str(e),
             })
@@ -826,10 +918,8 @@ async def websocket_agent(websocket: WebSocket):
         agent = get_default_agent(llm=llm, cli_mode=True)
 
         # ── Create Workspace ──────────────────────────────
-        agent_server_alive = (
-            _agent_server.process is not None
-            and _agent_server.process.poll() is None
-        )
+        agent_server_alive = _agent_server.is_running
+        repo_context: Optional[str] = None
 
         if agent_server_alive:
             workspace = Workspace(host=_agent_server.base_url)
@@ -838,27 +928,16 @@ async def websocket_agent(websocket: WebSocket):
             # Clone repo if provided
             if repo_url:
                 branch_label = f" (branch: {branch})" if branch else ""
-                await websocket.send_json({
+                await _send(websocket, {
                     "type": "agent_event",
                     "event": "system",
                     "content": f"Cloning repository: {repo_url}{branch_label}...",
                 })
 
-                clone_url = repo_url
-                if token and "github.com" in repo_url:
-                    clone_url = repo_url.replace(
-                        "https://",
-                        f"https://x-access-token:{token}@",
-                    )
-                elif token and "gitlab" in repo_url:
-                    clone_url = repo_url.replace(
-                        "https://",
-                        f"https://oauth2:{token}@",
-                    )
-
-                # Build clone command with optional branch
-                branch_flag = f" -b {branch}" if branch else ""
-                clone_cmd = f"git clone --depth 1{branch_flag} {clone_url} {WORKSPACE_MOUNT_PATH}/repo"
+                clone_cmd = _build_clone_cmd(
+                    _inject_git_credentials(repo_url, token),
+                    branch,
+                )
 
                 result = await asyncio.to_thread(
                     workspace.execute_command,
@@ -868,20 +947,21 @@ async def websocket_agent(websocket: WebSocket):
                 if result.exit_code == 0:
                     branch_info = f" on branch '{branch}'" if branch else ""
                     repo_name = repo_url.rstrip('/').split('/')[-1].replace('.git', '')
-                    await websocket.send_json({
+                    repo_context = _repo_context_message(repo_url, branch)
+                    await _send(websocket, {
                         "type": "agent_event",
                         "event": "system",
                         "content": f"✅ Cloned repository '{repo_name}'{branch_info}.",
                     })
                 else:
-                    await websocket.send_json({
+                    await _send(websocket, {
                         "type": "agent_event",
                         "event": "warning",
                         "content": f"⚠️ Clone failed: {result.stdout}",
                     })
         else:
-            workspace_dir = f"/tmp/lucid_workspace/{uuid.uuid4()}"
-            os.makedirs(workspace_dir, exist_ok=True)
+            workspace_dir = f"{LOCAL_WORKSPACE_BASE}/{uuid.uuid4()}"
+            _make_workspace_dir(workspace_dir)
             workspace = workspace_dir
             logger.info(f"📁 WebSocket session using LocalWorkspace: {workspace_dir}")
 
@@ -897,26 +977,17 @@ async def websocket_agent(websocket: WebSocket):
         session.agent = agent
         session.workspace = workspace
 
-        # Event callback → queue → WebSocket
-        def on_event(event):
-            event_data = _format_sdk_event(event)
-            if event_data:
-                try:
-                    session.event_buffer.put_nowait(event_data)
-                except asyncio.QueueFull:
-                    pass
-
-        conversation = Conversation(
+        conversation = await asyncio.to_thread(
+            Conversation,
             agent=agent,
             workspace=workspace,
-            callbacks=[on_event],
+            callbacks=[session.push_event],
         )
         session.conversation = conversation
 
-        async with _session_lock:
-            active_sessions[session_id] = session
+        active_sessions[session_id] = session
 
-        await websocket.send_json({
+        await _send(websocket, {
             "type": "status",
             "status": "ready",
             "sessionId": session_id,
@@ -931,18 +1002,24 @@ async def websocket_agent(websocket: WebSocket):
         )
 
         # Send initial task to the agent
-        await websocket.send_json({
+        await _send(websocket, {
             "type": "agent_event",
             "event": "task_start",
             "content": f"🤖 Agent starting task: {task}",
         })
 
+        # Stable repo context first, then the per-session task, so the
+        # LLM prompt prefix is shared across sessions of the same repo.
+        if repo_context:
+            conversation.send_message(repo_context)
         conversation.send_message(task)
 
         # Run the agent (blocking until completion/max iterations)
-        await asyncio.to_thread(conversation.run)
+        await asyncio.get_running_loop().run_in_executor(
+            _AGENT_EXECUTOR, conversation.run
+        )
 
-        await websocket.send_json({
+        await _send(websocket, {
             "type": "status",
             "status": "completed",
             "message": "Agent task completed.",
@@ -950,19 +1027,30 @@ async def websocket_agent(websocket: WebSocket):
 
         # ── Step 4: Listen for follow-up messages ─────────
         while True:
-            data = await websocket.receive_json()
+            try:
+                data = await _recv(websocket)
+            except orjson.JSONDecodeError:
+                data = None
+            # A malformed frame (or valid JSON that isn't an object)
+            # shouldn't tear down the session
+            if not isinstance(data, dict):
+                await _send(websocket, {
+                    "type": "error",
+                    "message": "Invalid JSON",
+                })
+                continue
             msg_type = data.get("type", "message")
             content = data.get("content", "")
 
             if not content:
-                await websocket.send_json({
+                await _send(websocket, {
                     "type": "error",
                     "message": "Empty content",
                 })
                 continue
 
             if msg_type == "stop":
-                await websocket.send_json({
+                await _send(websocket, {
                     "type": "status",
                     "status": "stopping",
                     "message": "Stopping agent...",
@@ -974,16 +1062,18 @@ async def websocket_agent(websocket: WebSocket):
                 f"📩 [{session_id}] Follow-up: {content[:80]}..."
             )
 
-            await websocket.send_json({
+            await _send(websocket, {
                 "type": "agent_event",
                 "event": "task_start",
                 "content": f"🤖 Processing: {content[:80]}...",
             })
 
             conversation.send_message(content)
-            await asyncio.to_thread(conversation.run)
+            await asyncio.get_running_loop().run_in_executor(
+                _AGENT_EXECUTOR, conversation.run
+            )
 
-            await websocket.send_json({
+            await _send(websocket, {
                 "type": "status",
                 "status": "completed",
                 "message": "Follow-up task completed.",
@@ -997,7 +1087,7 @@ async def websocket_agent(websocket: WebSocket):
     except asyncio.TimeoutError:
         logger.warning("⏰ WebSocket initial config timeout")
         try:
-            await websocket.send_json({
+            await _send(websocket, {
                 "type": "error",
                 "message": "Timeout waiting for initial configuration.",
             })
@@ -1006,7 +1096,7 @@ async def websocket_agent(websocket: WebSocket):
     except Exception as e:
         logger.error(f"❌ WebSocket error: {e}", exc_info=True)
         try:
-            await websocket.send_json({
+            await _send(websocket, {
                 "type": "error",
                 "message": f"Internal error: {str(e)}",
             })
@@ -1034,10 +1124,10 @@ async def websocket_agent(websocket: WebSocket):
 
 def _resolve_llm(
     provider: str,
-    user_api_key: Optional[str] = None,
+    user_api_key: Optional[SecretStr] = None,
 ) -> "LLM":
     """
-    Build an LLM instance for the given provider.
+    Build (or reuse) an LLM instance for the given provider.
 
     Resolution order for the API key:
       1. User-supplied key (from frontend)
@@ -1047,6 +1137,9 @@ def _resolve_llm(
     For Google Gemini, safety_settings are set to BLOCK_NONE
     so the coding agent isn't refused when generating code that
     looks like shell commands, network requests, etc.
+
+    Built instances are kept in an LRU keyed on (provider, key
+    digest), so repeat sessions with the same key share one LLM.
     """
     if provider not in MODEL_CONFIGS:
         raise ValueError(
@@ -1059,8 +1152,8 @@ def _resolve_llm(
 
     # Resolve API key with fallback chain
     resolved_key = (
-        user_api_key
-        or os.getenv(config["env_key"], "")
+        (user_api_key.get_secret_value() if user_api_key else "")
+        or config["default_key"]
         or LLM_API_KEY
     )
 
@@ -1071,65 +1164,216 @@ def _resolve_llm(
             f"provide a key in the request."
         )
 
-    # Build kwargs for the LLM constructor
+    # Reuse a previously built LLM for the same provider + key
+    cache_key = (provider, _api_key_digest(resolved_key))
+    cached = _llm_cache.get(cache_key)
+    if cached is not None:
+        _llm_cache.move_to_end(cache_key)
+        return cached
+
     llm_kwargs = {
-        "model": model_name,
+        **_base_llm_kwargs(provider),
         "api_key": SecretStr(resolved_key),
     }
 
-    if LLM_BASE_URL:
-        llm_kwargs["base_url"] = LLM_BASE_URL
-
-    # Gemini-specific: disable safety filters for coding agents
     if provider == "google":
-        llm_kwargs["safety_settings"] = GEMINI_SAFETY_SETTINGS
         logger.info(
             f"🔮 Using Gemini ({model_name}) with safety_settings=BLOCK_NONE"
         )
     else:
         logger.info(f"🧠 Using Anthropic ({model_name})")
 
-    return LLM(**llm_kwargs)
+    llm = LLM(**llm_kwargs)
+    _llm_cache[cache_key] = llm
+    if len(_llm_cache) > LLM_CACHE_SIZE:
+        # Only drop the reference: live conversations may still hold
+        # the evicted LLM, and GC reclaims it once they're done
+        _llm_cache.popitem(last=False)
+    return llm
+
+
+@functools.lru_cache(maxsize=8)
+def _base_llm_kwargs(provider: str) -> MappingProxyType:
+    """
+    LLM constructor kwargs for a provider, minus the API key.
+    Depends only on import-time config, so it is built once.
+    """
+    llm_kwargs: Dict[str, Any] = {"model": MODEL_CONFIGS[provider]["model"]}
+
+    if LLM_BASE_URL:
+        llm_kwargs["base_url"] = LLM_BASE_URL
+
+    # Gemini-specific: disable safety filters for coding agents
+    if provider == "google":
+        llm_kwargs["safety_settings"] = GEMINI_SAFETY_SETTINGS
+
+    return MappingProxyType(llm_kwargs)
+
+
+def _api_key_digest(api_key: str) -> str:
+    """Short, non-reversible cache key for an API key."""
+    return hashlib.blake2b(api_key.encode(), digest_size=16).hexdigest()
+
+
+# ── Git clone helpers ─────────────────────────────────────
+# One anchored scan picks the provider; the matched host selects
+# the credential prefix GitHub / GitLab expect for token auth.
+_GIT_HOST_RE = re.compile(r"^https://(?P<host>github\.com|gitlab[\w.-]*)/")
+
+_GIT_CRED_FMT = {
+    "github.com": "x-access-token:{token}",
+    "gitlab": "oauth2:{token}",
+}
+
+
+def _inject_git_credentials(url: str, token: Optional[str]) -> str:
+    """
+    Embed an access token into an HTTPS GitHub / GitLab clone URL.
+    Returns the URL unchanged if there is no token or no known host.
+    """
+    if not token:
+        return url
+
+    match = _GIT_HOST_RE.match(url)
+    if not match:
+        return url
+
+    host = match.group("host")
+    cred = _GIT_CRED_FMT["github.com" if host == "github.com" else "gitlab"]
+    return f"https://{cred.format(token=token)}@{url[len('https://'):]}"
+
+
+def _build_clone_cmd(clone_url: str, branch: Optional[str] = None) -> str:
+    """Shallow-clone command into the workspace, with optional branch."""
+    branch_flag = f" -b {branch}" if branch else ""
+    return f"git clone --depth 1{branch_flag} {clone_url} {WORKSPACE_MOUNT_PATH}/repo"
+
+
+def _repo_context_message(repo_url: str, branch: Optional[str] = None) -> str:
+    """
+    Describe the cloned repository to the agent.
+
+    Deterministic for a given repo + branch (no task text, no token,
+    no timestamps) so it extends the cacheable prompt prefix that
+    follows the SDK's static system prompt.
+    """
+    branch_info = f" (branch: {branch})" if branch else ""
+    return (
+        f"The repository {repo_url}{branch_info} is checked out at "
+        f"{WORKSPACE_MOUNT_PATH}/repo. Work inside that directory."
+    )
+
 
 async def _stream_events_to_ws(
     websocket: WebSocket,
     session: AgentSession,
 ):
     """
-    Background task: reads events from the session's buffer
-    queue and sends them to the WebSocket client in real-time.
+    Background task: waits for the session's event buffer to be
+    signalled, drains it in one burst and sends the events to the
+    WebSocket client.
+
+    A lone event is sent as-is; when several are already queued
+    they are coalesced into `agent_event_batch` frames so a chatty
+    agent costs one WebSocket write per burst, not per event.
 
     Auto-triggers a file_tree refresh when file-changing events
     are detected (create, write, rm, git clone, etc.).
     """
+    buffer = session.event_buffer
+    last_seq = -1
     try:
         while session.is_alive:
-            try:
-                event_data = await asyncio.wait_for(
-                    session.event_buffer.get(), timeout=1.0
+            # No timeout: an idle session costs nothing. Teardown sets
+            # the event (or cancels this task) to wake us up.
+            await session.event_ready.wait()
+
+            # Clear before draining so a concurrent append re-arms the event
+            session.event_ready.clear()
+            batch = []
+            while buffer:
+                batch.append(buffer.popleft())
+            if not batch:
+                continue
+
+            # The buffer evicts its oldest entries when full — tell the
+            # client how many it missed instead of dropping them silently
+            dropped = batch[0]["seq"] - last_seq - 1
+            last_seq = batch[-1]["seq"]
+            if dropped > 0:
+                logger.warning(
+                    f"⚠️  [{session.session_id}] Event buffer overflow — "
+                    f"{dropped} events dropped"
                 )
-                await websocket.send_json(event_data)
-
-                # ── Auto-sync: refresh file tree on file-changing events ──
-                if _should_refresh_file_tree(event_data):
-                    try:
-                        tree = await _list_files_in_workspace(session)
-                        await websocket.send_json({
-                            "type": "file_tree",
-                            "tree": tree,
-                            "timestamp": _now_iso(),
-                        })
-                    except Exception as tree_err:
-                        logger.warning(
-                            f"⚠️  File tree refresh failed: {tree_err}"
-                        )
+                batch.insert(0, {
+                    "type": "agent_event",
+                    "event": "dropped",
+                    "count": dropped,
+                    "timestamp": _utcnow(),
+                })
 
-            except asyncio.TimeoutError:
-                continue  # No events yet, keep polling
+            # Strip the writer-only hint before anything is serialized
+            refresh_tree = False
+            for e in batch:
+                if e.pop("_refresh_tree", False):
+                    refresh_tree = True
+
+            try:
+                await _send_event_batch(websocket, batch)
             except Exception:
                 break  # WebSocket closed
+
+            # ── Auto-sync: refresh file tree on file-changing events ──
+            if refresh_tree:
+                _schedule_tree_refresh(session, websocket)
     except asyncio.CancelledError:
         pass
+    finally:
+        if session.tree_refresh_task:
+            session.tree_refresh_task.cancel()
+
+
+# A burst of file-changing events shares one `find` scan
+_TREE_REFRESH_DEBOUNCE = 0.5  # seconds
+
+
+def _schedule_tree_refresh(session: AgentSession, websocket: WebSocket):
+    """
+    Mark the session's file tree stale and make sure a refresh is
+    pending. Triggers that arrive while one is pending are absorbed
+    by it; a trigger that lands mid-scan queues exactly one more.
+    """
+    session.tree_dirty = True
+    task = session.tree_refresh_task
+    if task is None or task.done():
+        session.tree_refresh_task = asyncio.create_task(
+            _delayed_tree_refresh(session, websocket)
+        )
+
+
+async def _delayed_tree_refresh(session: AgentSession, websocket: WebSocket):
+    """Send a fresh file_tree once the debounce window has passed."""
+    while session.tree_dirty and session.is_alive:
+        await asyncio.sleep(_TREE_REFRESH_DEBOUNCE)
+        session.tree_dirty = False
+        try:
+            tree = await _list_files_in_workspace(session)
+            session.tree_cache = (time.monotonic(), tree)
+
+            # Most file-changing commands leave the visible tree as it
+            # was (edits, reinstalls) — don't resend an identical one
+            tree_hash = hash(_dumps(tree))
+            if tree_hash == session.last_tree_hash:
+                continue
+            session.last_tree_hash = tree_hash
+
+            await _send(websocket, {
+                "type": "file_tree",
+                "tree": tree,
+                "timestamp": _utcnow(),
+            })
+        except Exception as tree_err:
+            logger.warning(f"⚠️  File tree refresh failed: {tree_err}")
 
 
 def _format_sdk_event(event) -> Optional[dict]:
@@ -1138,61 +1382,134 @@ def _format_sdk_event(event) -> Optional[dict]:
     for WebSocket transmission.
 
     Events in the V1 SDK are typed objects with attributes like
-    `type(event).__name__`, and fields vary by event type.
+    `type(event).__name__`, and fields vary by event type. The
+    formatter for each event class is resolved once and cached.
     """
-    event_type = type(event).__name__
-    content = ""
-
-    # Extract content based on event type
-    if hasattr(event, "content"):
-        content = str(event.content)
-    elif hasattr(event, "message"):
-        content = str(event.message)
-    elif hasattr(event, "text"):
-        content = str(event.text)
-
-    # Classify the event for the frontend
-    if isinstance(event, ConversationStateUpdateEvent):
-        return {
-            "type": "agent_event",
-            "event": "state_update",
-            "content": content or str(event),
-            "timestamp": _now_iso(),
-        }
+    return _event_formatter(type(event))(event)
 
-    # Map common event type names
-    event_category = "observation"
-    if "Action" in event_type:
-        event_category = "action"
-    elif "Error" in event_type:
-        event_category = "error"
-    elif "State" in event_type or "Update" in event_type:
-        event_category = "state"
+
+@functools.lru_cache(maxsize=256)
+def _event_formatter(event_cls: type) -> Callable[[Any], Optional[dict]]:
+    """Pick the formatter for an SDK event class (cached per class)."""
+    if issubclass(event_cls, ConversationStateUpdateEvent):
+        return _format_state_update_event
+    return _format_agent_event
+
+
+# Attribute probes per SDK event class, resolved from the first
+# instance seen: (content attribute or None, optional field getters)
+_CONTENT_ATTRS = ("content", "message", "text")
+_OPTIONAL_FIELDS = (
+    ("command", "command"),
+    ("exitCode", "exit_code"),
+    ("path", "path"),
+    ("thought", "thought"),
+)
+_event_layouts: Dict[type, Tuple[Optional[Callable], Tuple]] = {}
+_MISSING = object()
+
+
+def _event_layout(event) -> Tuple[Optional[Callable], Tuple]:
+    """Return the cached attribute getters for this event's class."""
+    layout = _event_layouts.get(type(event))
+    if layout is None:
+        content_getter = next(
+            (
+                operator.attrgetter(name)
+                for name in _CONTENT_ATTRS
+                if getattr(event, name, _MISSING) is not _MISSING
+            ),
+            None,
+        )
+        fields = tuple(
+            (key, operator.attrgetter(name))
+            for key, name in _OPTIONAL_FIELDS
+            if getattr(event, name, _MISSING) is not _MISSING
+        )
+        layout = _event_layouts[type(event)] = (content_getter, fields)
+    return layout
+
+
+def _event_content(event, limit: Optional[int] = None) -> str:
+    """Extract the human-readable text carried by an SDK event."""
+    content_getter, _ = _event_layout(event)
+    return _clip_text(content_getter(event), limit) if content_getter else ""
+
+
+def _clip_text(value: Any, limit: Optional[int]) -> str:
+    """
+    Render `value` as at most `limit` characters. str/bytes are
+    sliced before any conversion, so a multi-MB command output is
+    never copied in full just to be cut down to the WS preview.
+    """
+    if isinstance(value, str):
+        return value[:limit]
+    if isinstance(value, (bytes, bytearray)):
+        return value[:limit].decode("utf-8", "replace")
+    return str(value)[:limit] if value is not None else ""
+
+
+def _format_state_update_event(event) -> dict:
+    """Conversation state changes → `state_update` agent event."""
+    return {
+        "type": "agent_event",
+        "event": "state_update",
+        "content": _event_content(event) or str(event),
+        "timestamp": _utcnow(),
+    }
+
+
+def _format_agent_event(event) -> dict:
+    """Actions, observations and errors → categorized agent event."""
+    event_type = type(event).__name__
+    content = _event_content(event, 2000)  # Truncate for WS
+    event_category, changes_files = _classify_event_type(event_type)
 
     # Extract additional fields
     payload: dict = {
         "type": "agent_event",
         "event": event_category,
         "eventType": event_type,
-        "content": content[:2000],  # Truncate for WS
-        "timestamp": _now_iso(),
+        "content": content,
+        "timestamp": _utcnow(),
     }
 
-    # Add command-specific fields
-    if hasattr(event, "command"):
-        payload["command"] = str(event.command)
-    if hasattr(event, "exit_code"):
-        payload["exitCode"] = event.exit_code
-    if hasattr(event, "path"):
-        payload["path"] = str(event.path)
-    if hasattr(event, "thought"):
-        thought = event.thought
-        if thought:
-            payload["thought"] = str(thought)[:1000]
+    # Add command-specific fields (only those this class carries)
+    for key, getter in _event_layout(event)[1]:
+        value = getter(event)
+        if key == "exitCode":
+            payload[key] = value
+        elif key == "thought":
+            if value:
+                payload[key] = _clip_text(value, 1000)
+        else:
+            payload[key] = str(value)
+
+    # Writer-only hint (popped before sending): does this event
+    # change the workspace file tree?
+    if changes_files or _cmd_touches_fs(payload.get("command") or content):
+        payload["_refresh_tree"] = True
 
     return payload
 
 
+@functools.lru_cache(maxsize=256)
+def _classify_event_type(event_type: str) -> Tuple[str, bool]:
+    """
+    Map an SDK event class name to its frontend category, plus
+    whether that event type always changes the file tree.
+    """
+    event_category = "observation"
+    if "Action" in event_type:
+        event_category = "action"
+    elif "Error" in event_type:
+        event_category = "error"
+    elif "State" in event_type or "Update" in event_type:
+        event_category = "state"
+
+    return event_category, event_type in _FILE_CHANGE_EVENT_TYPES
+
+
 async def _mock_agent_loop(
     websocket: WebSocket,
     session: AgentSession,
@@ -1263,17 +1580,17 @@ async def _mock_agent_loop(
     ]
 
     for step in mock_steps:
-        step["timestamp"] = _now_iso()
-        await websocket.send_json(step)
+        step["timestamp"] = _utcnow()
+        await _send(websocket, step)
         await asyncio.sleep(1.5)
 
     # Listen for follow-up messages
     try:
         while True:
-            data = await websocket.receive_json()
+            data = await _recv(websocket)
             content = data.get("content", "")
             if content:
-                await websocket.send_json({
+                await _send(websocket, {
                     "type": "agent_event",
                     "event": "observation",
                     "eventType": "MockResponse",
@@ -1281,7 +1598,7 @@ async def _mock_agent_loop(
                         f"[MOCK] Received: \"{content}\"\n"
                         "The agent would process this in production mode."
                     ),
-                    "timestamp": _now_iso(),
+                    "timestamp": _utcnow(),
                 })
     except (WebSocketDisconnect, Exception):
         pass
@@ -1289,13 +1606,13 @@ async def _mock_agent_loop(
 
 async def _destroy_session(session_id: str):
     """Stop and clean up an agent session."""
-    async with _session_lock:
-        session = active_sessions.pop(session_id, None)
+    session = active_sessions.pop(session_id, None)
 
     if not session:
         return
 
     session.is_alive = False
+    session.event_ready.set()  # wake the WebSocket writer so it exits
     logger.info(f"🗑️  Destroying session {session_id}")
 
     # Close the conversation (cleans up agent-server resources)
@@ -1309,27 +1626,117 @@ async def _destroy_session(session_id: str):
                 f"⚠️  Error closing conversation: {e}"
             )
 
-    # Clean up local workspace directory if applicable
-    if isinstance(session.workspace, str) and session.workspace.startswith("/tmp/"):
-        try:
-            import shutil
-            shutil.rmtree(session.workspace, ignore_errors=True)
-        except Exception:
-            pass
+    # Clean up local workspace directory if applicable — in the
+    # background on the fs pool, so a large tree doesn't stall the loop
+    if isinstance(session.workspace, str) and session.workspace.startswith(LOCAL_WORKSPACE_BASE + "/"):
+        cleanup = asyncio.get_running_loop().run_in_executor(
+            _FS_EXECUTOR, shutil.rmtree, session.workspace, True
+        )
+        _workspace_cleanups.add(cleanup)
+        cleanup.add_done_callback(_log_cleanup_error)
+
+
+def _log_cleanup_error(future: "asyncio.Future"):
+    """Done-callback for background workspace removal."""
+    _workspace_cleanups.discard(future)
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"⚠️  Workspace cleanup failed: {future.exception()}")
+
+
+def _make_workspace_dir(path: str):
+    """Create a session's local workspace under LOCAL_WORKSPACE_BASE."""
+    try:
+        os.mkdir(path)
+    except FileExistsError:
+        pass
+
+
+def _dumps(obj: Any) -> bytes:
+    """Serialize `obj` to JSON bytes with orjson."""
+    return orjson.dumps(
+        obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+    )
 
 
-def _now_iso() -> str:
-    """Return current UTC time as ISO string."""
-    return datetime.now(timezone.utc).isoformat()
+def _send(websocket: WebSocket, obj: Any):
+    """Serialize `obj` with orjson and send it as one binary frame."""
+    return websocket.send_bytes(_dumps(obj))
+
+
+# Per-frame limits for coalesced agent events — keeps bursts from
+# turning into oversized frames the browser has to parse in one go.
+_BATCH_MAX_EVENTS = 128
+_BATCH_MAX_BYTES = 64 * 1024
+_BATCH_HEAD = b'{"type":"agent_event_batch","events":['
+_BATCH_TAIL = b"]}"
+
+
+async def _send_event_batch(websocket: WebSocket, events: List[dict]):
+    """
+    Send a burst of agent events in as few frames as possible.
+    Each event is encoded once and the batch frames are assembled
+    by joining the encoded bytes; a single event goes out unwrapped.
+    """
+    async def flush(items: List[bytes]):
+        if len(items) == 1:
+            await websocket.send_bytes(items[0])
+        else:
+            await websocket.send_bytes(
+                _BATCH_HEAD + b",".join(items) + _BATCH_TAIL
+            )
+
+    frame: List[bytes] = []
+    frame_bytes = 0
+    for event in events:
+        encoded = _dumps(event)
+        if frame and (
+            len(frame) >= _BATCH_MAX_EVENTS
+            or frame_bytes + len(encoded) > _BATCH_MAX_BYTES
+        ):
+            await flush(frame)
+            frame, frame_bytes = [], 0
+        frame.append(encoded)
+        frame_bytes += len(encoded) + 1
+
+    if frame:
+        await flush(frame)
+
+
+async def _recv(websocket: WebSocket) -> Any:
+    """
+    Receive one client frame and parse it with orjson.
+
+    Reads the raw ASGI message so text and binary frames are both
+    accepted; binary frames go straight to orjson (which validates
+    UTF-8 itself) without an intermediate str.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+
+    data = message.get("bytes")
+    if data is None:
+        data = message.get("text") or ""
+    return orjson.loads(data)
+
+
+def _utcnow() -> datetime:
+    """
+    Return the current UTC time. Event timestamps stay datetimes —
+    orjson serializes them natively (ISO 8601, `Z` suffix).
+    """
+    return datetime.now(timezone.utc)
 
 
 # ── File-change detection patterns ────────────────────────
 # Commands / event types that indicate the workspace file tree
 # may have changed and should be re-sent to the frontend.
+# Prefix-factored alternation (shared leading literals are tested
+# once, no capture group). `pip install` is covered by `install`.
 _FILE_CHANGE_COMMANDS = re.compile(
-    r"\b(touch|mkdir|rm|rmdir|mv|cp|git\s+clone|git\s+checkout|"
-    r"git\s+pull|wget|curl\s+-[oO]|unzip|tar|npm\s+init|pip\s+install|"
-    r"npx|create-react-app|tee|dd|install)\b",
+    r"\b(?:t(?:ouch|ar|ee)|mkdir|rm(?:dir)?|mv|cp|dd|wget|unzip|"
+    r"git\s+(?:clone|checkout|pull)|curl\s+-o|npm\s+init|npx|"
+    r"create-react-app|install)\b",
     re.IGNORECASE,
 )
 
@@ -1338,27 +1745,24 @@ _FILE_CHANGE_EVENT_TYPES = {
     "FileEditAction", "FileEditObservation",
     "FileCreateAction", "FileCreateObservation",
     "FileDeleteAction", "FileDeleteObservation",
-    "CmdRunAction",  # handled via command regex below
 }
+# CmdRunAction is decided per command via _FILE_CHANGE_COMMANDS
 
 
-def _should_refresh_file_tree(event_data: dict) -> bool:
-    """
-    Determine if an agent event indicates the workspace file tree
-    may have changed. Used to auto-send file_tree updates.
-    """
-    event_type = event_data.get("eventType", "")
-
-    # File write / edit / create / delete events always trigger refresh
-    if event_type in _FILE_CHANGE_EVENT_TYPES and event_type != "CmdRunAction":
-        return True
+def _cmd_touches_fs(command: str) -> bool:
+    """True if a command (or event text) looks like it changes files."""
+    if not command:
+        return False
+    # Agents repeat short commands (ls, pytest, …) — memoize those;
+    # long texts are rarely repeated and would only bloat the cache
+    if len(command) <= 256:
+        return _short_cmd_touches_fs(command)
+    return _FILE_CHANGE_COMMANDS.search(command) is not None
 
-    # For command events, check the actual command text
-    command = event_data.get("command", "") or event_data.get("content", "")
-    if command and _FILE_CHANGE_COMMANDS.search(command):
-        return True
 
-    return False
+@functools.lru_cache(maxsize=1024)
+def _short_cmd_touches_fs(command: str) -> bool:
+    return _FILE_CHANGE_COMMANDS.search(command) is not None
 
 
 async def _list_files_in_workspace(
@@ -1369,7 +1773,7 @@ async def _list_files_in_workspace(
     List all files in the agent's workspace as a recursive tree.
 
     For remote workspaces (Docker): runs `find` inside the container.
-    For local workspaces: uses os.walk on the host filesystem.
+    For local workspaces: uses os.scandir on the host filesystem.
 
     Returns:
         [
@@ -1381,7 +1785,9 @@ async def _list_files_in_workspace(
 
     if isinstance(workspace, str):
         # ── Local workspace ──────────────────────────────
-        return _build_local_file_tree(workspace)
+        return await asyncio.get_running_loop().run_in_executor(
+            _FS_EXECUTOR, _build_local_file_tree, workspace
+        )
     else:
         # ── Remote workspace (Docker sandbox) ────────────
         return await _build_remote_file_tree(workspace, root)
@@ -1389,7 +1795,9 @@ async def _list_files_in_workspace(
 
 def _build_local_file_tree(root_dir: str) -> List[dict]:
     """
-    Build a file tree from a local directory using os.walk.
+    Build a file tree from a local directory with an iterative
+    os.scandir walk. Directory entries carry their type from the
+    dirent, so no extra stat() per entry is needed.
     Excludes common noise directories (.git, node_modules, __pycache__, .next).
     """
     EXCLUDE_DIRS = {
@@ -1398,36 +1806,43 @@ def _build_local_file_tree(root_dir: str) -> List[dict]:
         "dist", "build", ".tox", ".eggs",
     }
 
-    def walk_dir(dir_path: str) -> List[dict]:
-        entries = []
+    # Paths are reported relative to the root: slice the prefix off
+    # DirEntry.path instead of os.path.relpath per entry
+    root_len = len(root_dir.rstrip("/"))
+
+    # Breadth-first walk; each queued folder carries the list its
+    # children are appended to, so the nested tree is built in place
+    tree: List[dict] = []
+    pending = deque([(root_dir, tree)])
+
+    while pending:
+        dir_path, entries = pending.popleft()
         try:
-            items = sorted(os.listdir(dir_path))
-        except PermissionError:
-            return entries
+            with os.scandir(dir_path) as it:
+                items = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
 
         for item in items:
-            full_path = os.path.join(dir_path, item)
-            rel_path = os.path.relpath(full_path, root_dir)
-
-            if os.path.isdir(full_path):
-                if item in EXCLUDE_DIRS or item.startswith("."):
+            if item.is_dir(follow_symlinks=False):
+                if item.name in EXCLUDE_DIRS or item.name.startswith("."):
                     continue
+                children: List[dict] = []
                 entries.append({
-                    "name": item,
+                    "name": item.name,
                     "type": "folder",
-                    "path": "/" + rel_path,
-                    "children": walk_dir(full_path),
+                    "path": item.path[root_len:],
+                    "children": children,
                 })
+                pending.append((item.path, children))
             else:
                 entries.append({
-                    "name": item,
+                    "name": item.name,
                     "type": "file",
-                    "path": "/" + rel_path,
+                    "path": item.path[root_len:],
                 })
 
-        return entries
-
-    return walk_dir(root_dir)
+    return tree
 
 
 async def _build_remote_file_tree(
@@ -1447,59 +1862,64 @@ async def _build_remote_file_tree(
         "-name venv -prune -o "
     )
 
+    # One `find` reports each path with its type (d/f/l…), so folders
+    # are known without a second `-type d` pass. No `sort` needed —
+    # convert() orders siblings by name. `head` caps pathological
+    # workspaces inside the container, before the output is shipped.
     cmd = (
         f'find {root} {EXCLUDE_PATTERNS}'
-        f'-print 2>/dev/null | sort'
+        f'-printf "%y\\t%p\\n" 2>/dev/null | head -n {FILE_TREE_MAX_ENTRIES}'
     )
 
-    result = await asyncio.to_thread(workspace.execute_command, cmd)
+    result = await asyncio.get_running_loop().run_in_executor(
+        _FS_EXECUTOR, workspace.execute_command, cmd
+    )
 
     raw_output = result.stdout if hasattr(result, 'stdout') else str(result)
-    lines = [l.strip() for l in raw_output.strip().split("\n") if l.strip()]
-
-    # Filter out the root itself and any empty lines
-    lines = [l for l in lines if l and l != root]
-
-    if not lines:
-        return []
 
     # Build tree from flat paths
     tree_root: Dict[str, Any] = {"children": {}}
+    dir_set = set()
+    entries = 0
+
+    # splitlines() beats a StringIO here: StringIO copies the text
+    # into a UCS-4 buffer. `head -n` above already bounds the listing.
+    for line in raw_output.splitlines():
+        entries += 1
+        kind, sep, path = line.partition("\t")
+        path = path.strip()
+        # Skip malformed lines and the root itself
+        if not sep or not path or path == root:
+            continue
 
-    for line in lines:
         # Make path relative to root
-        if line.startswith(root):
-            rel = line[len(root):].lstrip("/")
+        if path.startswith(root):
+            rel = path[len(root):].lstrip("/")
         else:
-            rel = line.lstrip("/")
+            rel = path.lstrip("/")
 
         if not rel:
             continue
 
-        parts = rel.split("/")
-        current = tree_root
+        if kind == "d":
+            dir_set.add(rel)
 
-        for i, part in enumerate(parts):
+        current = tree_root
+        for part in rel.split("/"):
             if part not in current["children"]:
-                is_last = (i == len(parts) - 1)
                 current["children"][part] = {
                     "name": part,
                     "children": {},
                 }
             current = current["children"][part]
 
-    # Now determine folder vs file by checking for children,
-    # and then run `find -type d` to get definitive folder list
-    dir_cmd = f'find {root} {EXCLUDE_PATTERNS}-type d -print 2>/dev/null'
-    dir_result = await asyncio.to_thread(workspace.execute_command, dir_cmd)
-    dir_output = dir_result.stdout if hasattr(dir_result, 'stdout') else str(dir_result)
-    dir_set = set()
-    for d in dir_output.strip().split("\n"):
-        d = d.strip()
-        if d.startswith(root):
-            dir_set.add(d[len(root):].lstrip("/"))
-        elif d:
-            dir_set.add(d.lstrip("/"))
+    if entries >= FILE_TREE_MAX_ENTRIES:
+        logger.warning(
+            f"⚠️  File tree truncated at {FILE_TREE_MAX_ENTRIES} entries"
+        )
+
+    if not tree_root["children"]:
+        return []
 
     def convert(node: dict, parent_path: str = "") -> List[dict]:
         result_list = []
@@ -1538,4 +1958,9 @@ if __name__ == "__main__":
         port=PORT,
         reload=True,
         log_level="info",
+        loop="uvloop" if uvloop is not None else "asyncio",
+        http="httptools",
+        ws="websockets",
+        # permessage-deflate: repetitive agent-event JSON compresses well
+        ws_per_message_deflate=True,
     )
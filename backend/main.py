@@ -4,19 +4,35 @@
 # ─────────────────────────────────────────────────────────
 
 import os
+import base64
+import hashlib
+import shlex
+import time
+import shutil
+import socket
 import uuid
 import asyncio
+import functools
+import itertools
 import logging
+import orjson
 from datetime import datetime, timezone
-from typing import Optional
+from types import MappingProxyType
+from urllib.parse import quote, urlsplit
+from typing import Any, Callable, Optional
+import contextlib
 from contextlib import asynccontextmanager
 
 from fastapi import (
     FastAPI,
     WebSocket,
     WebSocketDisconnect,
+    Depends,
     Header,
     HTTPException,
+    Query,
+    Request,
+    Response,
     status,
 )
 from pydantic import BaseModel, Field
@@ -44,12 +60,20 @@ try:
         AgentStateChangedObservation,
         ErrorObservation,
     )
-    from openhands.events.stream import EventStream
+    from openhands.events.stream import EventStream, EventStreamSubscriber
+    import docker
 
     OPENHANDS_AVAILABLE = True
 except ImportError:
     OPENHANDS_AVAILABLE = False
 
+# ── Optional: Redis session directory ───────────────────────
+# Only needed when running several Uvicorn workers (see REDIS_URL).
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
 # ═══════════════════════════════════════════════════════════
 #  Logging
 # ═══════════════════════════════════════════════════════════
@@ -69,14 +93,82 @@ LLM_API_KEY = os.getenv("LLM_API_KEY", "")
 LLM_BASE_URL = os.getenv("LLM_BASE_URL", None)
 MAX_ITERATIONS = int(os.getenv("MAX_ITERATIONS", "50"))
 CONTAINER_IMAGE = os.getenv("SANDBOX_IMAGE", "python:3.12-bookworm")
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))  # per client
+BACKFILL_EVENTS = int(os.getenv("BACKFILL_EVENTS", "200"))  # history on connect
+
+# Backpressure hysteresis (queued events): enter at ENTER, leave once
+# the sender has drained back down to EXIT
+BACKPRESSURE_ENTER = int(os.getenv("BACKPRESSURE_ENTER", "200"))
+BACKPRESSURE_EXIT = int(os.getenv("BACKPRESSURE_EXIT", "32"))
+
+# Pre-started idle sandboxes kept ready for new sessions (0 disables)
+POOL_SIZE = int(os.getenv("POOL_SIZE", "4"))
+
+# Shared session directory for multi-worker deployments (optional).
+# Runtimes stay in the worker that created them; Redis only records
+# which worker owns which session so the others can redirect.
+REDIS_URL = os.getenv("REDIS_URL", "")
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+# Directory entries expire this long after their worker stops
+# heartbeating, so a crashed worker's sessions don't linger
+DIRECTORY_TTL = int(os.getenv("DIRECTORY_TTL", "30"))  # seconds
+
+# Host-side bare mirrors of cloned repos, per org, bind-mounted
+# read-only into cold-started sandboxes as /git-cache ("" disables).
+# The daemon resolves the mount on the host, so when this service runs
+# in a container with the Docker socket, use the same path in both.
+GIT_CACHE_DIR = os.getenv("GIT_CACHE_DIR", "")
+# Note: warm-pool sandboxes start before any repo is known, so they
+# get no mount — the cache only helps cold starts (POOL_SIZE=0 or an
+# empty pool).
+# Only https:// repos on these hosts are mirrored (the mirror is
+# cloned on the host, so never from file paths or other transports)
+GIT_CACHE_HOSTS = frozenset(
+    h.strip().lower()
+    for h in os.getenv("GIT_CACHE_HOSTS", "github.com,gitlab.com,bitbucket.org").split(",")
+    if h.strip()
+)
+# Total size of all mirrors; least-recently-used ones are evicted
+GIT_CACHE_MAX_BYTES = int(os.getenv("GIT_CACHE_MAX_BYTES", str(10 * 1024**3)))
+GIT_CHECK_TIMEOUT = float(os.getenv("GIT_CHECK_TIMEOUT", "15"))  # seconds
+
+# GET /sessions: per-org response cache lifetime, and the per-caller
+# request rate (token bucket) for the polled endpoints
+SESSIONS_CACHE_TTL = float(os.getenv("SESSIONS_CACHE_TTL", "1.0"))  # seconds
+RATE_LIMIT_PER_SEC = float(os.getenv("RATE_LIMIT_PER_SEC", "30"))
 
 # ═══════════════════════════════════════════════════════════
 #  Global Session Store
 # ═══════════════════════════════════════════════════════════
 
+class ClientFeed:
+    """
+    One WebSocket client's view of a session's events: its own
+    bounded queue, backpressure state and frame sequence, so a slow
+    client only ever drops its own events.
+    """
+
+    __slots__ = ("queue", "backpressure", "dropped", "dropped_ids", "seq")
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.backpressure = False   # slow client — queue above ENTER
+        self.dropped = 0            # evicted since last `backpressure` notice
+        self.dropped_ids: Optional[tuple] = None  # (first, last) evicted event id
+        # Sequence number stamped on every frame sent to this client
+        self.seq = itertools.count()
+
+
 class AgentSessionInfo:
     """Holds runtime + agent state for a single user session."""
 
+    __slots__ = (
+        "session_id", "user_id", "org_id",
+        "runtime", "controller", "event_stream",
+        "created_at", "created_at_iso", "is_alive", "container_name",
+        "subscribers",
+    )
+
     def __init__(
         self,
         session_id: str,
@@ -93,15 +185,55 @@ class AgentSessionInfo:
         self.controller = controller
         self.event_stream = event_stream
         self.created_at = datetime.now(timezone.utc)
+        self.created_at_iso = self.created_at.isoformat()  # immutable — format once
         self.is_alive = True
         self.container_name = f"sandbox_{user_id}"
 
+        # Connected WebSocket clients. The session's single EventStream
+        # subscription fans each event out to all of them.
+        self.subscribers: list[ClientFeed] = []
+
 
 # Global dict: user_id → AgentSessionInfo
 active_runtimes: dict[str, AgentSessionInfo] = {}
 
-# Lock to prevent race conditions during session creation
-_session_lock = asyncio.Lock()
+# Secondary index: session_id → AgentSessionInfo (O(1) stop/connect)
+sessions_by_id: dict[str, AgentSessionInfo] = {}
+
+# Secondary index: org_id → its sessions (for GET /sessions)
+# (inner dict keyed by session_id: O(1) add/remove, creation order)
+sessions_by_org: dict[str, dict[str, AgentSessionInfo]] = {}
+
+# Per-user locks: one user can't create two sandboxes at once, but
+# different users create theirs in parallel. user_id → [lock, number
+# of requests holding or waiting on it]; see _user_lock.
+_user_locks: dict[str, list] = {}
+
+# Warm pool of connected, never-used DockerRuntimes. A sandbox is
+# handed to exactly one session and closed with it — containers are
+# never recycled across users, the pool is refilled with fresh ones.
+_runtime_pool: asyncio.Queue = asyncio.Queue(maxsize=max(POOL_SIZE, 1))
+_pool_refill_task: Optional[asyncio.Task] = None
+
+# One Docker API client (and connection pool) shared by every runtime
+_docker_client: Optional[object] = None
+
+# Redis client for the session directory (None → single-worker mode)
+_redis: Optional[object] = None
+_directory_heartbeat_task: Optional[asyncio.Task] = None
+
+# Running git-cache refreshes, keyed by mirror path (one per repo)
+_git_cache_tasks: dict[str, asyncio.Task] = {}
+
+# org_id → (expiry, encoded GET /sessions body); dropped whenever a
+# session of that org starts or stops. Only orgs with sessions are
+# cached, and expired entries are pruned once it reaches the cap.
+_sessions_cache: dict[str, tuple[float, bytes]] = {}
+_SESSIONS_CACHE_MAX = 1_000
+
+# caller → [tokens, last refill] for _rate_limit
+_rate_buckets: dict[str, list[float]] = {}
+_RATE_BUCKETS_MAX = 10_000
 
 
 # ═══════════════════════════════════════════════════════════
@@ -112,10 +244,38 @@ _session_lock = asyncio.Lock()
 async def lifespan(app: FastAPI):
     """Cleanup all Docker containers when the server shuts down."""
     logger.info("🚀 u-code Agent Microservice starting...")
+
+    global _redis, _directory_heartbeat_task
+    if REDIS_URL and aioredis is not None:
+        _redis = aioredis.Redis.from_url(REDIS_URL)
+        # Drop leftovers from a previous process with the same id
+        await _directory_clear_worker()
+        _directory_heartbeat_task = asyncio.create_task(_directory_heartbeat())
+        logger.info(f"🗂️  Session directory: Redis (worker={WORKER_ID})")
+    elif REDIS_URL:
+        logger.warning("⚠️  REDIS_URL set but redis is not installed — ignoring")
+
+    # Pre-start sandboxes in the background so boot isn't delayed
+    if OPENHANDS_AVAILABLE and POOL_SIZE > 0:
+        _schedule_pool_refill()
+
     yield
     logger.info("🛑 Shutting down — cleaning up all sandboxes...")
-    for user_id in list(active_runtimes.keys()):
-        await _destroy_session(user_id)
+    # Tear sandboxes down concurrently — each close is a blocking
+    # Docker call in a worker thread, so N sessions ≈ one close time
+    await asyncio.gather(
+        *(_destroy_session(user_id) for user_id in list(active_runtimes)),
+        return_exceptions=True,
+    )
+    await _drain_runtime_pool()
+    if _docker_client is not None:
+        _docker_client.close()
+    if _redis is not None:
+        _directory_heartbeat_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _directory_heartbeat_task
+        await _directory_clear_worker()
+        await _redis.aclose()
     logger.info("✅ All sandboxes cleaned up.")
 
 
@@ -173,14 +333,44 @@ class StopSessionResponse(BaseModel):
 #  Health Check
 # ═══════════════════════════════════════════════════════════
 
-@app.get("/")
-def health_check():
-    return {
-        "service": "u-code Agent Microservice",
-        "status": "healthy",
-        "openhands_available": OPENHANDS_AVAILABLE,
-        "active_sessions": len(active_runtimes),
-    }
+# Fields that never change for the life of the process
+_STATIC_HEALTH = MappingProxyType({
+    "service": "u-code Agent Microservice",
+    "status": "healthy",
+    "openhands_available": OPENHANDS_AVAILABLE,
+})
+
+
+async def _rate_limit(request: Request):
+    """
+    Token-bucket limiter for polled endpoints: RATE_LIMIT_PER_SEC
+    requests per second per caller (X-User-ID, else client address),
+    bursting up to the same number.
+    """
+    key = request.headers.get("X-User-ID") or (
+        request.client.host if request.client else "unknown"
+    )
+    now = time.monotonic()
+
+    bucket = _rate_buckets.get(key)
+    if bucket is None:
+        if len(_rate_buckets) >= _RATE_BUCKETS_MAX:
+            _rate_buckets.clear()  # forgetting buckets only refills them
+        bucket = _rate_buckets[key] = [RATE_LIMIT_PER_SEC, now]
+
+    tokens = min(RATE_LIMIT_PER_SEC, bucket[0] + (now - bucket[1]) * RATE_LIMIT_PER_SEC)
+    if tokens < 1:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests — slow down.",
+        )
+    bucket[0], bucket[1] = tokens - 1, now
+
+
+@app.get("/", dependencies=[Depends(_rate_limit)])
+async def health_check():
+    # async: runs on the loop instead of taking a threadpool slot
+    return {**_STATIC_HEALTH, "active_sessions": len(active_runtimes)}
 
 
 # ═══════════════════════════════════════════════════════════
@@ -201,25 +391,33 @@ async def start_session(
       the CodeActAgent, and store everything in memory.
     """
 
-    async with _session_lock:
+    # Fast path: an existing live session needs no lock
+    existing = active_runtimes.get(x_user_id)
+    if existing and existing.is_alive:
+        return _existing_session_response(existing)
+
+    async with _user_lock(x_user_id):
         # ── Check for existing session ──────────────────────
+        # (again — another request may have created it meanwhile)
         if x_user_id in active_runtimes:
             existing = active_runtimes[x_user_id]
             if existing.is_alive:
-                logger.info(
-                    f"♻️  Returning existing session for user={x_user_id} "
-                    f"session={existing.session_id}"
-                )
-                return StartSessionResponse(
-                    session_id=existing.session_id,
-                    container_name=existing.container_name,
-                    status="active",
-                    message="Existing active session returned",
-                )
+                return _existing_session_response(existing)
             else:
                 # Dead session — clean up and create new
                 await _destroy_session(x_user_id)
 
+        # Owned by another worker? Hand back that session instead
+        # of starting a second sandbox for the same user.
+        remote = await _directory_get(_user_key(x_user_id))
+        if remote and remote.get("is_alive") and remote.get("worker") != WORKER_ID:
+            return StartSessionResponse(
+                session_id=remote["session_id"],
+                container_name=remote["container_name"],
+                status="active",
+                message="Existing active session returned",
+            )
+
         # ── Create new session ──────────────────────────────
         session_id = str(uuid.uuid4())
         container_name = f"sandbox_{x_user_id}"
@@ -240,6 +438,7 @@ async def start_session(
         if OPENHANDS_AVAILABLE:
             try:
                 runtime, controller, event_stream = await _initialize_openhands(
+                    session_info=session_info,
                     session_id=session_id,
                     container_name=container_name,
                     task=body.task,
@@ -254,7 +453,8 @@ async def start_session(
                 session_info.event_stream = event_stream
 
                 logger.info(
-                    f"✅ OpenHands runtime ready — container={container_name}"
+                    f"✅ OpenHands runtime ready — "
+                    f"container={session_info.container_name}"
                 )
 
             except Exception as e:
@@ -270,16 +470,55 @@ async def start_session(
             )
 
         active_runtimes[x_user_id] = session_info
+        sessions_by_id[session_id] = session_info
+        sessions_by_org.setdefault(x_org_id, {})[session_id] = session_info
+        _sessions_cache.pop(x_org_id, None)
+        await _directory_publish(session_info)
 
         return StartSessionResponse(
             session_id=session_id,
-            container_name=container_name,
+            container_name=session_info.container_name,
             container_url=container_url,
             status="active",
             message="Session started successfully",
         )
 
 
+@asynccontextmanager
+async def _user_lock(user_id: str):
+    """
+    Hold `user_id`'s creation lock. The entry is dropped by the last
+    request holding or waiting on it (whether its start succeeded or
+    not), so a later request can never get a second lock while the
+    first is still in use.
+    """
+    entry = _user_locks.get(user_id)
+    if entry is None:
+        entry = _user_locks[user_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and _user_locks.get(user_id) is entry:
+            del _user_locks[user_id]
+
+
+def _existing_session_response(existing: AgentSessionInfo) -> StartSessionResponse:
+    """Response for a user who already has a live session."""
+    logger.info(
+        f"♻️  Returning existing session for user={existing.user_id} "
+        f"session={existing.session_id}"
+    )
+    return StartSessionResponse(
+        session_id=existing.session_id,
+        container_name=existing.container_name,
+        status="active",
+        message="Existing active session returned",
+    )
+
+
 # ═══════════════════════════════════════════════════════════
 #  POST /stop-session/{agent_session_id}
 # ═══════════════════════════════════════════════════════════
@@ -293,25 +532,22 @@ async def stop_session(
     """Stop and destroy a user's sandbox session."""
 
     # Find session by agent_session_id
-    target_user_id = None
-    for uid, session in active_runtimes.items():
-        if session.session_id == agent_session_id:
-            # Verify ownership
-            if session.user_id != x_user_id:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="You do not own this session.",
-                )
-            target_user_id = uid
-            break
+    session = sessions_by_id.get(agent_session_id)
 
-    if target_user_id is None:
+    if session is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Session {agent_session_id} not found.",
         )
 
-    await _destroy_session(target_user_id)
+    # Verify ownership
+    if session.user_id != x_user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not own this session.",
+        )
+
+    await _destroy_session(session.user_id)
 
     return StopSessionResponse(
         session_id=agent_session_id,
@@ -324,26 +560,102 @@ async def stop_session(
 #  GET /sessions — List active sessions (admin/debug)
 # ═══════════════════════════════════════════════════════════
 
-@app.get("/sessions")
+@app.get("/sessions", dependencies=[Depends(_rate_limit)])
 async def list_sessions(
     x_user_id: str = Header(..., alias="X-User-ID"),
     x_org_id: str = Header(..., alias="X-Org-ID"),
 ):
     """List all active sessions (filtered to the requesting user's org)."""
-    return {
-        "sessions": [
-            SessionStatusResponse(
-                session_id=s.session_id,
-                user_id=s.user_id,
-                org_id=s.org_id,
-                container_name=s.container_name,
-                is_alive=s.is_alive,
-                created_at=s.created_at.isoformat(),
-            ).model_dump()
-            for s in active_runtimes.values()
-            if s.org_id == x_org_id
-        ]
-    }
+    now = time.monotonic()
+    cached = _sessions_cache.get(x_org_id)
+    if cached is not None and cached[0] > now:
+        body = cached[1]
+    else:
+        org_sessions = sessions_by_org.get(x_org_id, {})
+        # Plain dicts in the SessionStatusResponse shape — no per-row
+        # model construction/validation just to dump it again
+        body = orjson.dumps({
+            "sessions": [
+                {
+                    "session_id": s.session_id,
+                    "user_id": s.user_id,
+                    "org_id": s.org_id,
+                    "container_name": s.container_name,
+                    "is_alive": s.is_alive,
+                    "created_at": s.created_at_iso,
+                }
+                for s in org_sessions.values()
+            ]
+        })
+        # Unknown orgs (the header is client-supplied) aren't cached
+        if org_sessions:
+            if len(_sessions_cache) >= _SESSIONS_CACHE_MAX:
+                _prune_sessions_cache(now)
+            _sessions_cache[x_org_id] = (now + SESSIONS_CACHE_TTL, body)
+
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"Cache-Control": f"private, max-age={int(SESSIONS_CACHE_TTL)}"},
+    )
+
+
+def _prune_sessions_cache(now: float):
+    """Drop expired GET /sessions entries (all of them if none expired)."""
+    expired = [org for org, (expiry, _) in _sessions_cache.items() if expiry <= now]
+    for org in expired:
+        del _sessions_cache[org]
+    if not expired:
+        _sessions_cache.clear()
+
+
+# ═══════════════════════════════════════════════════════════
+#  GET /sessions/{agent_session_id}/events — Replay after a gap
+# ═══════════════════════════════════════════════════════════
+
+@app.get("/sessions/{agent_session_id}/events")
+async def replay_events(
+    agent_session_id: str,
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=5000),
+    x_user_id: str = Header(..., alias="X-User-ID"),
+    x_org_id: str = Header(..., alias="X-Org-ID"),
+):
+    """
+    Return a session's formatted events starting at event id `since`.
+    Clients call this after a WebSocket `gap` notice to fill in the
+    events that were dropped under backpressure.
+    """
+    session_info = sessions_by_id.get(agent_session_id)
+
+    if session_info is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Session {agent_session_id} not found.",
+        )
+    if session_info.user_id != x_user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not own this session.",
+        )
+
+    if not OPENHANDS_AVAILABLE or not session_info.event_stream:
+        return {"events": []}
+
+    # get_events may read back from the file store — keep it off the loop
+    events = await asyncio.to_thread(
+        lambda: list(itertools.islice(
+            session_info.event_stream.get_events(start_id=since), limit
+        ))
+    )
+
+    replay = []
+    for event in events:
+        payload = _format_event(event)
+        if payload:
+            payload["event_id"] = getattr(event, "id", None)
+            replay.append(payload)
+    return {"events": replay}
 
 
 # ═══════════════════════════════════════════════════════════
@@ -372,6 +684,10 @@ async def websocket_agent(
       { "type": "observation", "event": "cmd_output", "content": "..." }
       { "type": "agent_state", "state": "running" }
       { "type": "error", "message": "..." }
+      { "type": "gap", "from": 12, "to": 40 }   (replay via /events)
+
+    Streamed events carry `event_id` and a per-connection `seq`. On
+    connect the client first receives the session's recent history.
     """
 
     # ── 1. Extract identity from query params ─────────────
@@ -383,13 +699,16 @@ async def websocket_agent(
         return
 
     # ── 2. Find the session ───────────────────────────────
-    session_info = None
-    for s in active_runtimes.values():
-        if s.session_id == session_id and s.user_id == user_id:
-            session_info = s
-            break
+    session_info = sessions_by_id.get(session_id)
+
+    if session_info is None:
+        # Live in another worker? Tell the client / LB to re-route.
+        remote = await _directory_get(_session_key(session_id))
+        if remote and remote.get("user_id") == user_id and remote.get("worker") != WORKER_ID:
+            await websocket.close(code=4030, reason="Session is owned by another worker")
+            return
 
-    if not session_info:
+    if not session_info or session_info.user_id != user_id:
         await websocket.close(code=4004, reason="Session not found or access denied")
         return
 
@@ -403,30 +722,37 @@ async def websocket_agent(
         f"🔌 WebSocket connected — user={user_id} session={session_id}"
     )
 
-    await websocket.send_json({
+    await _send(websocket, {
         "type": "connected",
         "session_id": session_id,
         "message": "Connected to agent session",
     })
 
     # ── 4. Message Loop ───────────────────────────────────
+    observation_task: Optional[asyncio.Task] = None
+    feed = ClientFeed()
+    session_info.subscribers.append(feed)
     try:
         # Start a background task to stream observations
         observation_task = asyncio.create_task(
-            _stream_observations(websocket, session_info)
+            _stream_observations(websocket, session_info, feed)
         )
 
         while True:
-            # Receive client message
-            data = await websocket.receive_json()
+            # Receive client message — a malformed frame (or JSON that
+            # isn't an object) gets an error, not a dropped session
+            try:
+                data = await _recv(websocket)
+            except orjson.JSONDecodeError:
+                data = None
+            if not isinstance(data, dict):
+                await websocket.send_text(_INVALID_JSON_FRAME)
+                continue
             msg_type = data.get("type", "message")
             content = data.get("content", "")
 
             if not content:
-                await websocket.send_json({
-                    "type": "error",
-                    "message": "Empty content",
-                })
+                await websocket.send_text(_EMPTY_CONTENT_FRAME)
                 continue
 
             logger.info(
@@ -444,23 +770,23 @@ async def websocket_agent(
                     else:
                         action = MessageAction(content=content)
 
-                    # Dispatch the action to the event stream
-                    session_info.event_stream.add_event(action, "user")
+                    # Dispatch the action to the event stream (add_event
+                    # persists it to the file store — keep that off the loop)
+                    await asyncio.to_thread(
+                        session_info.event_stream.add_event, action, "user"
+                    )
 
-                    await websocket.send_json({
-                        "type": "ack",
-                        "message": f"Action dispatched: {msg_type}",
-                    })
+                    await websocket.send_text(_ack_frame(msg_type))
 
                 except Exception as e:
                     logger.error(f"❌ Agent action error: {e}", exc_info=True)
-                    await websocket.send_json({
+                    await _send(websocket, {
                         "type": "error",
                         "message": f"Agent error: {str(e)}",
                     })
             else:
                 # ── Mock mode ─────────────────────────────
-                await websocket.send_json({
+                await _send(websocket, {
                     "type": "observation",
                     "event": "mock_response",
                     "content": (
@@ -475,37 +801,52 @@ async def websocket_agent(
     except Exception as e:
         logger.error(f"❌ WebSocket error: {e}", exc_info=True)
         try:
-            await websocket.send_json({
+            await _send(websocket, {
                 "type": "error",
                 "message": f"Internal error: {str(e)}",
             })
         except Exception:
             pass
     finally:
-        # Cancel the observation streaming task
-        if "observation_task" in dir() and observation_task:
+        # Cancel the observation streaming task and wait for it, so
+        # its queue/socket references are released before we return
+        if observation_task is not None:
             observation_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await observation_task
+        session_info.subscribers.remove(feed)
 
 
 # ═══════════════════════════════════════════════════════════
 #  Internal Helpers
 # ═══════════════════════════════════════════════════════════
 
-async def _initialize_openhands(
-    session_id: str,
-    container_name: str,
-    task: str,
-    repo_url: Optional[str],
-    branch: str,
-    git_token: Optional[str],
-    sandbox_mode: bool,
-):
-    """
-    Initialize the OpenHands DockerRuntime + CodeActAgent.
-    Returns (runtime, controller, event_stream).
-    """
+def _shared_docker_client():
+    """The process-wide Docker client, created on first use."""
+    global _docker_client
+    if _docker_client is None:
+        _docker_client = docker.from_env()
+    return _docker_client
 
-    # ── Build config ──────────────────────────────────
+
+if OPENHANDS_AVAILABLE:
+    class SharedDockerRuntime(DockerRuntime):
+        """
+        DockerRuntime that talks to the daemon through the shared
+        client instead of opening its own — N sandboxes reuse one
+        keep-alive connection pool rather than N of them.
+        """
+
+        @staticmethod
+        def _init_docker_client():
+            return _shared_docker_client()
+
+
+def _build_app_config(
+    container_name: str,
+    volumes: Optional[str] = None,
+) -> "AppConfig":
+    """OpenHands config for one sandbox container."""
     llm_config = LLMConfig(
         model=LLM_MODEL,
         api_key=LLM_API_KEY,
@@ -517,42 +858,135 @@ async def _initialize_openhands(
         container_name=container_name,
         timeout=300,
         enable_auto_lint=True,
+        **({"volumes": volumes} if volumes else {}),
     )
 
-    config = AppConfig(
+    return AppConfig(
         llm=llm_config,
         sandbox=sandbox_config,
         max_iterations=MAX_ITERATIONS,
         workspace_base="/workspace",
     )
 
+
+async def _initialize_openhands(
+    session_info: AgentSessionInfo,
+    session_id: str,
+    container_name: str,
+    task: str,
+    repo_url: Optional[str],
+    branch: str,
+    git_token: Optional[str],
+    sandbox_mode: bool,
+):
+    """
+    Initialize the OpenHands DockerRuntime + CodeActAgent.
+    Returns (runtime, controller, event_stream).
+    """
+
+    # ── Build config ──────────────────────────────────
+    # Mount the org's mirror of this repo (if one exists yet) so the
+    # clone below only fetches objects the mirror doesn't have. The
+    # mirror may hold a private repo another member seeded, so only
+    # callers whose own credentials can read the repo get it.
+    git_cache = _git_cache_path(session_info.org_id, repo_url) if repo_url else None
+    if git_cache and not await _git_can_read(repo_url, git_token):
+        git_cache = None
+    volumes = (
+        f"{git_cache}:/git-cache:ro"
+        if git_cache and await asyncio.to_thread(_touch_git_cache, git_cache)
+        else None
+    )
+    config = _build_app_config(container_name, volumes)
+    llm_config = config.llm
+
     # ── Initialize event stream ───────────────────────
     event_stream = EventStream(sid=session_id)
 
-    # ── Create runtime ────────────────────────────────
-    runtime = DockerRuntime(
-        config=config,
-        event_stream=event_stream,
-        sid=session_id,
+    # Push every event into the session's queue as it is emitted.
+    # EventStream invokes subscribers on its own threads, so hop
+    # back onto the event loop before touching the asyncio.Queue.
+    loop = asyncio.get_running_loop()
+
+    def _on_stream_event(event):
+        loop.call_soon_threadsafe(_fan_out, session_info, event)
+
+    event_stream.subscribe(
+        EventStreamSubscriber.SERVER,
+        _on_stream_event,
+        _subscriber_id(session_id),
     )
 
-    # Start the sandbox container
-    await asyncio.to_thread(runtime.connect)
+    # ── Create runtime ────────────────────────────────
+    # Take a pre-started sandbox from the warm pool if one is ready;
+    # otherwise cold-start one (seconds) on the request path.
+    try:
+        runtime = _runtime_pool.get_nowait()
+    except asyncio.QueueEmpty:
+        runtime = None
+
+    if runtime is not None:
+        _rebind_runtime(runtime, event_stream, session_id)
+        session_info.container_name = getattr(
+            runtime, "container_name", session_info.container_name
+        )
+        logger.info(f"⚡ Using warm sandbox {session_info.container_name}")
+    else:
+        runtime = SharedDockerRuntime(
+            config=config,
+            event_stream=event_stream,
+            sid=session_id,
+        )
+
+        # Start the sandbox container
+        await asyncio.to_thread(runtime.connect)
+
+    if POOL_SIZE > 0:
+        _schedule_pool_refill()
 
     # ── Clone repo if provided ────────────────────────
     if repo_url:
-        clone_url = repo_url
-        if git_token and "github.com" in repo_url:
-            # Inject token into HTTPS URL for private repos
-            clone_url = repo_url.replace(
-                "https://", f"https://x-access-token:{git_token}@"
-            )
-        elif git_token and "gitlab" in repo_url:
-            clone_url = repo_url.replace(
-                "https://", f"https://oauth2:{git_token}@"
+        # Private repos: write the token to a throwaway credential-store
+        # file through the runtime directly (not an event, so it isn't
+        # persisted in the stream) and point this one git call at it.
+        # The token stays out of the command line, the event stream and
+        # the clone's .git/config, and the file is removed when the
+        # clone exits. An absolute path works whatever the sandbox user.
+        login = _git_login(repo_url) if git_token else None
+        cred_path = None
+        if login:
+            parts = urlsplit(repo_url)
+            cred_path = f"/tmp/.git-cred-{uuid.uuid4().hex}"
+            obs = await asyncio.to_thread(
+                runtime.write,
+                FileWriteAction(
+                    path=cred_path,
+                    content=(
+                        f"{parts.scheme}://{quote(login, safe='')}:"
+                        f"{quote(git_token, safe='')}@{parts.netloc}\n"
+                    ),
+                ),
             )
-
-        clone_cmd = f"git clone --branch {branch} --depth 1 {clone_url} /workspace/repo"
+            if isinstance(obs, ErrorObservation):
+                logger.warning(f"⚠️  Could not stage git credentials: {obs.content}")
+                cred_path = None
+
+        # No TTY in the sandbox: fail fast instead of waiting on a prompt
+        clone_args = ["env", "GIT_TERMINAL_PROMPT=0", "git"]
+        if cred_path:
+            clone_args += ["-c", f"credential.helper=store --file={cred_path}"]
+        clone_args += ["clone", "--branch", branch, "--depth", "1"]
+        if git_cache:
+            # Borrow objects from the mirror when it's mounted (warm
+            # sandboxes don't have it — "if-able" skips it there), then
+            # copy them so the clone doesn't depend on the mount
+            clone_args += ["--reference-if-able", "/git-cache", "--dissociate"]
+            _schedule_git_cache_refresh(git_cache, repo_url, git_token)
+        clone_cmd = shlex.join([*clone_args, "--", repo_url, "/workspace/repo"])
+        if cred_path:
+            # Subshell + EXIT trap: the file goes whether or not the
+            # clone succeeds, and the exit status is still git's
+            clone_cmd = f"(trap {shlex.quote(f'rm -f {cred_path}')} EXIT; {clone_cmd})"
         action = CmdRunAction(command=clone_cmd)
         event_stream.add_event(action, "system")
 
@@ -578,93 +1012,645 @@ async def _initialize_openhands(
     return runtime, controller, event_stream
 
 
+def _git_login(repo_url: str) -> Optional[str]:
+    """Token username git expects for this host (None if unsupported)."""
+    if "github.com" in repo_url:
+        return "x-access-token"
+    if "gitlab" in repo_url:
+        return "oauth2"
+    return None
+
+
+# ── Git mirror cache ──────────────────────────────────────
+
+def _git_cache_path(org_id: str, repo_url: str) -> Optional[str]:
+    """
+    Host path of an org's bare mirror of `repo_url` (None if disabled
+    or the URL isn't cacheable). Both path components are hashes, so
+    a client-supplied org id can't escape or share another's dir.
+    """
+    if not GIT_CACHE_DIR or not _git_cache_allowed(repo_url):
+        return None
+    org_hash = hashlib.sha256(org_id.encode()).hexdigest()[:16]
+    repo_hash = hashlib.sha1(repo_url.encode()).hexdigest()[:12]
+    return os.path.join(GIT_CACHE_DIR, org_hash, repo_hash)
+
+
+def _git_cache_allowed(repo_url: str) -> bool:
+    """Only plain https:// URLs on an allowlisted host are mirrored."""
+    try:
+        parts = urlsplit(repo_url)
+    except ValueError:
+        return False
+    return (
+        parts.scheme == "https"
+        and (parts.hostname or "") in GIT_CACHE_HOSTS
+        and not parts.username
+        and not parts.password
+    )
+
+
+def _schedule_git_cache_refresh(
+    cache_dir: str,
+    repo_url: str,
+    git_token: Optional[str],
+):
+    """Create/update a mirror in the background (one run per repo)."""
+    task = _git_cache_tasks.get(cache_dir)
+    if task is None or task.done():
+        _git_cache_tasks[cache_dir] = asyncio.create_task(
+            _refresh_git_cache(cache_dir, repo_url, git_token)
+        )
+
+
+def _git_auth_env(repo_url: str, git_token: Optional[str]) -> dict:
+    """Environment for host-side git calls against `repo_url`."""
+    env = {
+        **os.environ,
+        "GIT_TERMINAL_PROMPT": "0",
+        # Also bars redirects/submodules to file://, ext:: etc.
+        "GIT_ALLOW_PROTOCOL": "https",
+    }
+    login = _git_login(repo_url) if git_token else None
+    if login:
+        # Auth via env-only git config (git ≥ 2.31): the token stays
+        # out of argv and is never written to the mirror's config
+        basic = base64.b64encode(f"{login}:{git_token}".encode()).decode()
+        env.update(
+            GIT_CONFIG_COUNT="1",
+            GIT_CONFIG_KEY_0="http.extraHeader",
+            GIT_CONFIG_VALUE_0=f"Authorization: Basic {basic}",
+        )
+    return env
+
+
+async def _git_can_read(repo_url: str, git_token: Optional[str]) -> bool:
+    """Whether these credentials can read `repo_url` (host `git ls-remote`)."""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "git", "ls-remote", "--quiet", "--", repo_url, "HEAD",
+            env=_git_auth_env(repo_url, git_token),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    except Exception as e:
+        logger.warning(f"⚠️  Git access check failed for {repo_url}: {e}")
+        return False
+    try:
+        return await asyncio.wait_for(proc.wait(), GIT_CHECK_TIMEOUT) == 0
+    except asyncio.TimeoutError:
+        proc.kill()
+        return False
+
+
+def _touch_git_cache(cache_dir: str) -> bool:
+    """Mark a mirror as just used (for LRU eviction); False if absent."""
+    try:
+        os.utime(cache_dir)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _evict_git_cache():
+    """Remove least-recently-used mirrors until the cache fits its cap."""
+    mirrors = []
+    for org_dir in os.scandir(GIT_CACHE_DIR):
+        if not org_dir.is_dir(follow_symlinks=False):
+            continue
+        for entry in os.scandir(org_dir.path):
+            if entry.is_dir(follow_symlinks=False) and ".tmp-" not in entry.name:
+                mirrors.append((entry.stat().st_mtime, _dir_size(entry.path), entry.path))
+
+    total = sum(size for _, size, _ in mirrors)
+    for _, size, path in sorted(mirrors):
+        if total <= GIT_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        logger.info(f"🧹 Evicted git mirror {path} ({size >> 20} MiB)")
+
+
+def _dir_size(path: str) -> int:
+    """Bytes used by the files under `path`."""
+    return sum(
+        os.lstat(os.path.join(root, name)).st_size
+        for root, _, files in os.walk(path)
+        for name in files
+    )
+
+
+async def _refresh_git_cache(
+    cache_dir: str,
+    repo_url: str,
+    git_token: Optional[str],
+):
+    """
+    Bring the host-side bare mirror of `repo_url` up to date. A new
+    mirror is cloned next to its final path and renamed into place,
+    so sandboxes never mount a half-written one. Afterwards the cache
+    is trimmed back under GIT_CACHE_MAX_BYTES.
+    """
+    env = _git_auth_env(repo_url, git_token)
+
+    if await asyncio.to_thread(os.path.isdir, cache_dir):
+        args = ["git", "-C", cache_dir, "remote", "update", "--prune"]
+        staging = None
+    else:
+        await asyncio.to_thread(
+            os.makedirs, os.path.dirname(cache_dir), exist_ok=True
+        )
+        staging = f"{cache_dir}.tmp-{uuid.uuid4().hex[:8]}"
+        args = ["git", "clone", "--mirror", "--quiet", "--", repo_url, staging]
+
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            env=env,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            logger.warning(
+                f"⚠️  Git cache refresh failed for {repo_url}: "
+                f"{stderr.decode(errors='replace').strip()[:200]}"
+            )
+            return
+        if staging:
+            await asyncio.to_thread(os.rename, staging, cache_dir)
+        logger.info(f"📦 Git cache up to date: {repo_url}")
+        await asyncio.to_thread(_evict_git_cache)
+    except Exception as e:
+        logger.warning(f"⚠️  Git cache refresh failed for {repo_url}: {e}")
+    finally:
+        if staging:
+            await asyncio.to_thread(shutil.rmtree, staging, True)
+
+
+# ── Session directory (Redis) ─────────────────────────────
+# All helpers are no-ops without Redis, and a Redis outage only
+# degrades cross-worker routing — it never fails a request.
+
+def _session_key(session_id: str) -> str:
+    return f"session:{session_id}"
+
+
+def _user_key(user_id: str) -> str:
+    return f"user:{user_id}:session"
+
+
+def _worker_key(worker_id: str) -> str:
+    return f"worker:{worker_id}"
+
+
+def _worker_entries_key() -> str:
+    """Set of directory keys this worker has written."""
+    return f"worker:{WORKER_ID}:keys"
+
+
+async def _directory_publish(session_info: AgentSessionInfo):
+    """Record that this worker owns `session_info` (expires unless refreshed)."""
+    if _redis is None:
+        return
+    blob = orjson.dumps({
+        "session_id": session_info.session_id,
+        "user_id": session_info.user_id,
+        "org_id": session_info.org_id,
+        "container_name": session_info.container_name,
+        "worker": WORKER_ID,
+        "worker_pid": os.getpid(),
+        "created_at": session_info.created_at_iso,
+        "is_alive": session_info.is_alive,
+    })
+    keys = (_session_key(session_info.session_id), _user_key(session_info.user_id))
+    try:
+        pipe = _redis.pipeline(transaction=False)
+        pipe.set(_worker_key(WORKER_ID), "1", ex=DIRECTORY_TTL)
+        for key in keys:
+            pipe.set(key, blob, ex=DIRECTORY_TTL)
+        pipe.sadd(_worker_entries_key(), *keys)
+        pipe.expire(_worker_entries_key(), DIRECTORY_TTL)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"⚠️  Session directory write failed: {e}")
+
+
+async def _directory_get(key: str) -> Optional[dict]:
+    """Look a session up in the directory (None if absent/unavailable)."""
+    if _redis is None:
+        return None
+    try:
+        blob = await _redis.get(key)
+        if not blob:
+            return None
+        entry = orjson.loads(blob)
+        # Owner stopped heartbeating (crashed/restarted) → treat as gone
+        if not await _redis.exists(_worker_key(entry.get("worker", ""))):
+            return None
+    except Exception as e:
+        logger.warning(f"⚠️  Session directory read failed: {e}")
+        return None
+    return entry
+
+
+async def _directory_remove(session_info: AgentSessionInfo):
+    """Drop a destroyed session from the directory."""
+    if _redis is None:
+        return
+    keys = (_session_key(session_info.session_id), _user_key(session_info.user_id))
+    try:
+        pipe = _redis.pipeline(transaction=False)
+        pipe.delete(*keys)
+        pipe.srem(_worker_entries_key(), *keys)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"⚠️  Session directory delete failed: {e}")
+
+
+async def _directory_heartbeat():
+    """Keep this worker and its sessions' entries from expiring."""
+    while True:
+        try:
+            pipe = _redis.pipeline(transaction=False)
+            pipe.set(_worker_key(WORKER_ID), "1", ex=DIRECTORY_TTL)
+            for session_info in list(sessions_by_id.values()):
+                pipe.expire(_session_key(session_info.session_id), DIRECTORY_TTL)
+                pipe.expire(_user_key(session_info.user_id), DIRECTORY_TTL)
+            pipe.expire(_worker_entries_key(), DIRECTORY_TTL)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️  Session directory heartbeat failed: {e}")
+        await asyncio.sleep(DIRECTORY_TTL / 3)
+
+
+async def _directory_clear_worker():
+    """Remove every entry this worker still owns (startup/shutdown)."""
+    try:
+        keys = list(await _redis.smembers(_worker_entries_key()))
+        if keys:
+            # A user key may have been re-published by another worker
+            # since — only delete entries that still name this one
+            blobs = await _redis.mget(keys)
+            owned = [
+                key for key, blob in zip(keys, blobs)
+                if blob and orjson.loads(blob).get("worker") == WORKER_ID
+            ]
+            if owned:
+                await _redis.delete(*owned)
+        await _redis.delete(_worker_entries_key(), _worker_key(WORKER_ID))
+    except Exception as e:
+        logger.warning(f"⚠️  Session directory cleanup failed: {e}")
+
+
+# ── Warm sandbox pool ─────────────────────────────────────
+
+def _schedule_pool_refill():
+    """Top the warm pool back up in the background (one refill at a time)."""
+    global _pool_refill_task
+    if _pool_refill_task is None or _pool_refill_task.done():
+        _pool_refill_task = asyncio.create_task(_refill_runtime_pool())
+
+
+async def _refill_runtime_pool():
+    """Start sandboxes until the pool holds POOL_SIZE idle runtimes."""
+    missing = POOL_SIZE - _runtime_pool.qsize()
+    if missing <= 0:
+        return
+
+    results = await asyncio.gather(
+        *(_warm_runtime() for _ in range(missing)),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"⚠️  Failed to pre-start sandbox: {result}")
+
+    logger.info(f"🔥 Warm sandbox pool: {_runtime_pool.qsize()}/{POOL_SIZE}")
+
+
+async def _warm_runtime():
+    """
+    Start one idle sandbox and park it in the pool. A sandbox that
+    fails to connect, or whose warm-up is cancelled by a drain, is
+    closed here — it is in neither the pool nor a session yet.
+    """
+    pool_id = f"pool_{uuid.uuid4().hex[:12]}"
+    runtime = SharedDockerRuntime(
+        config=_build_app_config(f"sandbox_{pool_id}"),
+        event_stream=EventStream(sid=pool_id),
+        sid=pool_id,
+    )
+    connect = asyncio.ensure_future(asyncio.to_thread(runtime.connect))
+    parked = False
+    try:
+        await asyncio.shield(connect)
+        _runtime_pool.put_nowait(runtime)
+        parked = True
+    except asyncio.QueueFull:
+        pass
+    except asyncio.CancelledError:
+        # Cancelling can't stop the connect thread — let it settle
+        # before closing whatever container it started
+        with contextlib.suppress(Exception):
+            await connect
+        raise
+    finally:
+        if not parked:
+            await _close_pooled_runtime(runtime)
+
+
+def _rebind_runtime(runtime, event_stream, session_id: str):
+    """
+    Attach a pooled runtime to a new session's event stream. The
+    runtime subscribed its action handler to the placeholder stream
+    it was started with; move that subscription over.
+    """
+    try:
+        runtime.event_stream.unsubscribe(
+            EventStreamSubscriber.RUNTIME, runtime.sid
+        )
+    except Exception:
+        pass
+    runtime.event_stream = event_stream
+    runtime.sid = session_id
+    event_stream.subscribe(
+        EventStreamSubscriber.RUNTIME, runtime.on_event, session_id
+    )
+
+
+async def _drain_runtime_pool():
+    """Stop refilling and close every idle pooled sandbox."""
+    # Wait for the cancelled refill: each sandbox still warming up
+    # closes itself in _warm_runtime before the task finishes
+    if _pool_refill_task and not _pool_refill_task.done():
+        _pool_refill_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _pool_refill_task
+
+    runtimes = []
+    while not _runtime_pool.empty():
+        runtimes.append(_runtime_pool.get_nowait())
+
+    await asyncio.gather(*(_close_pooled_runtime(r) for r in runtimes))
+
+
+async def _close_pooled_runtime(runtime):
+    """Close a sandbox that never reached a session (errors are logged)."""
+    try:
+        await asyncio.to_thread(runtime.close)
+    except Exception as e:
+        logger.error(f"⚠️  Failed to close pooled sandbox: {e}")
+
+
+def _subscriber_id(session_id: str) -> str:
+    """EventStream callback id for a session's WebSocket relay."""
+    return f"ws_{session_id}"
+
+
+def _fan_out(session_info: AgentSessionInfo, event) -> None:
+    """Deliver a stream event to every connected client (loop thread)."""
+    for feed in session_info.subscribers:
+        _put_event(session_info, feed, event)
+
+
+def _put_event(session_info: AgentSessionInfo, feed: ClientFeed, event) -> None:
+    """
+    Enqueue a stream event for one client. The queue is bounded:
+    when a slow client lets it fill up, the oldest event is evicted
+    so memory stays flat and the client still sees the newest state.
+    """
+    queue = feed.queue
+    if queue.full():
+        evicted = queue.get_nowait()
+        feed.dropped += 1
+        evicted_id = getattr(evicted, "id", None)
+        if evicted_id is not None:
+            first = feed.dropped_ids[0] if feed.dropped_ids else evicted_id
+            feed.dropped_ids = (first, evicted_id)
+    queue.put_nowait(event)
+
+    if not feed.backpressure and queue.qsize() >= BACKPRESSURE_ENTER:
+        feed.backpressure = True
+        logger.warning(
+            f"⚠️  [{session_info.session_id}] Client is falling behind — "
+            f"{queue.qsize()} events queued, dropping oldest when full"
+        )
+
+
+def _recent_events(event_stream, limit: int) -> list:
+    """The last `limit` events of a stream, oldest first."""
+    recent = list(itertools.islice(event_stream.get_events(reverse=True), limit))
+    recent.reverse()
+    return recent
+
+
 async def _stream_observations(
     websocket: WebSocket,
     session_info: AgentSessionInfo,
+    feed: ClientFeed,
 ):
     """
-    Background task that polls the event stream for new
-    observations and sends them to the client via WebSocket.
+    Background task that first backfills the session's recent
+    history, then waits on this client's feed (fed by the session's
+    EventStream subscription) and sends each observation to the
+    client via WebSocket as soon as it is emitted.
     """
 
     if not OPENHANDS_AVAILABLE or not session_info.event_stream:
         return
 
-    last_event_id = -1
+    async def send_payload(payload: dict):
+        payload["seq"] = next(feed.seq)
+        await _send(websocket, payload)
 
-    try:
-        while session_info.is_alive:
-            await asyncio.sleep(0.3)  # Poll interval
+    async def send_event(event):
+        payload = _format_event(event)
+        if payload:
+            payload["event_id"] = getattr(event, "id", None)
+            await send_payload(payload)
 
-            try:
-                events = session_info.event_stream.get_events(
-                    start_id=last_event_id + 1
-                )
-            except Exception:
-                continue
+    queue = feed.queue
 
-            for event in events:
-                last_event_id = event.id if hasattr(event, "id") else last_event_id + 1
+    try:
+        # ── Backfill what happened before this client connected ──
+        # The feed is already registered, so events emitted while we
+        # read history are queued too — skip those by event id.
+        last_id = -1
+        history = await asyncio.to_thread(
+            _recent_events, session_info.event_stream, BACKFILL_EVENTS
+        )
+        for event in history:
+            last_id = getattr(event, "id", last_id)
+            await send_event(event)
 
-                # ── Format observation for the client ─────
-                payload = _format_event(event)
-                if payload:
-                    try:
-                        await websocket.send_json(payload)
-                    except Exception:
-                        return  # Connection closed
+        while session_info.is_alive:
+            event = await queue.get()
+            if event is None:
+                break  # Session destroyed
+
+            event_id = getattr(event, "id", None)
+            if event_id is not None and event_id <= last_id:
+                continue  # already sent in the backfill
+
+            if feed.backpressure and queue.qsize() <= BACKPRESSURE_EXIT:
+                feed.backpressure = False
+                logger.info(f"✅ [{session_info.session_id}] Client caught up")
+
+            # Tell the client how many events it missed, and which
+            # ones — it can replay them via GET /sessions/{id}/events
+            if feed.dropped:
+                notices = [{
+                    "type": "backpressure",
+                    "dropped": feed.dropped,
+                }]
+                if feed.dropped_ids:
+                    first, last = feed.dropped_ids
+                    notices.append({"type": "gap", "from": first, "to": last})
+                feed.dropped, feed.dropped_ids = 0, None
+                for notice in notices:
+                    await send_payload(notice)
+
+            # ── Format observation for the client ─────
+            payload = _format_event(event)
+            if not payload:
+                continue
+            payload["event_id"] = event_id
+            await send_payload(payload)
 
     except asyncio.CancelledError:
         pass
+    except Exception:
+        return  # Connection closed
 
 
-def _format_event(event) -> Optional[dict]:
-    """Convert an OpenHands event into a JSON-serializable dict."""
+def _send(websocket: WebSocket, obj):
+    """Serialize `obj` with orjson and send it as a text frame."""
+    return websocket.send_text(orjson.dumps(obj).decode())
+
+
+async def _recv(websocket: WebSocket):
+    """
+    Receive one client frame and parse it with orjson. Reads the raw
+    ASGI message, so text and binary frames are both accepted and
+    binary ones are parsed without an intermediate str.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+
+    data = message.get("bytes")
+    if data is None:
+        data = message.get("text") or ""
+    return orjson.loads(data)
+
+
+# Frames that are identical for every session — encoded once
+_EMPTY_CONTENT_FRAME = orjson.dumps(
+    {"type": "error", "message": "Empty content"}
+).decode()
+_INVALID_JSON_FRAME = orjson.dumps(
+    {"type": "error", "message": "Invalid JSON"}
+).decode()
+
+
+@functools.lru_cache(maxsize=16)
+def _ack_frame(msg_type: str) -> str:
+    return orjson.dumps(
+        {"type": "ack", "message": f"Action dispatched: {msg_type}"}
+    ).decode()
+
 
-    if isinstance(event, CmdOutputObservation):
+def _fmt_cmd_output(event) -> dict:
+    return {
+        "type": "observation",
+        "event": "cmd_output",
+        "content": event.content,
+        "command": getattr(event, "command", ""),
+        "exit_code": getattr(event, "exit_code", None),
+    }
+
+
+def _fmt_file_write(event) -> dict:
+    return {
+        "type": "observation",
+        "event": "file_write",
+        "path": getattr(event, "path", ""),
+        "content": event.content[:500],  # truncate for WS
+    }
+
+
+def _fmt_agent_state(event) -> dict:
+    return {
+        "type": "agent_state",
+        "state": str(getattr(event, "agent_state", "unknown")),
+    }
+
+
+def _fmt_error(event) -> dict:
+    return {
+        "type": "error",
+        "message": event.content,
+    }
+
+
+def _fmt_message(event) -> Optional[dict]:
+    # Agent's own messages (thinking, planning)
+    source = getattr(event, "source", "agent")
+    if source == "agent":
         return {
             "type": "observation",
-            "event": "cmd_output",
+            "event": "agent_message",
             "content": event.content,
-            "command": getattr(event, "command", ""),
-            "exit_code": getattr(event, "exit_code", None),
-        }
-    elif isinstance(event, FileWriteObservation):
-        return {
-            "type": "observation",
-            "event": "file_write",
-            "path": getattr(event, "path", ""),
-            "content": event.content[:500],  # truncate for WS
-        }
-    elif isinstance(event, AgentStateChangedObservation):
-        return {
-            "type": "agent_state",
-            "state": str(getattr(event, "agent_state", "unknown")),
         }
-    elif isinstance(event, ErrorObservation):
-        return {
-            "type": "error",
-            "message": event.content,
-        }
-    elif isinstance(event, MessageAction):
-        # Agent's own messages (thinking, planning)
-        source = getattr(event, "source", "agent")
-        if source == "agent":
-            return {
-                "type": "observation",
-                "event": "agent_message",
-                "content": event.content,
-            }
-
     return None
 
 
+# Event class → formatter. Exact classes hit the dict directly;
+# subclasses are resolved once via isinstance and then cached here
+# too (None = not forwarded to clients).
+FORMATTERS: dict[type, Optional[Callable[[Any], Optional[dict]]]] = (
+    {
+        CmdOutputObservation: _fmt_cmd_output,
+        FileWriteObservation: _fmt_file_write,
+        AgentStateChangedObservation: _fmt_agent_state,
+        ErrorObservation: _fmt_error,
+        MessageAction: _fmt_message,
+    }
+    if OPENHANDS_AVAILABLE
+    else {}
+)
+_BASE_FORMATTERS = tuple(FORMATTERS.items())
+
+
+def _format_event(event) -> Optional[dict]:
+    """Convert an OpenHands event into a JSON-serializable dict."""
+    event_cls = type(event)
+    try:
+        fn = FORMATTERS[event_cls]
+    except KeyError:
+        fn = next(
+            (f for cls, f in _BASE_FORMATTERS if isinstance(event, cls)),
+            None,
+        )
+        FORMATTERS[event_cls] = fn
+    return fn(event) if fn else None
+
+
 async def _destroy_session(user_id: str):
     """Stop the Docker container and clean up the session."""
 
     session = active_runtimes.pop(user_id, None)
     if not session:
         return
+    sessions_by_id.pop(session.session_id, None)
+    await _directory_remove(session)
+    org_sessions = sessions_by_org.get(session.org_id)
+    if org_sessions is not None:
+        org_sessions.pop(session.session_id, None)
+        _sessions_cache.pop(session.org_id, None)
+        if not org_sessions:
+            del sessions_by_org[session.org_id]
 
     session.is_alive = False
     logger.info(
@@ -672,6 +1658,18 @@ async def _destroy_session(user_id: str):
         f"container={session.container_name}"
     )
 
+    # Stop the event relay and wake the WebSocket task
+    if session.event_stream and OPENHANDS_AVAILABLE:
+        try:
+            session.event_stream.unsubscribe(
+                EventStreamSubscriber.SERVER,
+                _subscriber_id(session.session_id),
+            )
+        except Exception:
+            pass
+    for feed in session.subscribers:
+        _put_event(session, feed, None)
+
     if session.runtime and OPENHANDS_AVAILABLE:
         try:
             await asyncio.to_thread(session.runtime.close)
@@ -681,11 +1679,13 @@ async def _destroy_session(user_id: str):
                 f"⚠️  Failed to destroy container {session.container_name}: {e}"
             )
 
-    if session.controller:
+    if session.controller and OPENHANDS_AVAILABLE:
         try:
-            session.controller.close()
-        except Exception:
-            pass
+            # async in openhands ≥0.14 — stops the agent loop and
+            # unsubscribes it from the stream
+            await session.controller.close()
+        except Exception as e:
+            logger.error(f"⚠️  Failed to close agent controller: {e}")
 
 
 # ═══════════════════════════════════════════════════════════
@@ -14,6 +14,7 @@ import { useState, useRef, useCallback, useEffect } from 'react';
 
 const WS_BASE = process.env.NEXT_PUBLIC_AGENT_WS_URL || 'ws://localhost:8000/ws';
 const HEARTBEAT_INTERVAL_MS = 25_000; // 25s keep-alive ping
+const frameDecoder = new TextDecoder(); // binary (orjson) frames → JSON text
 
 // Derive the HTTP API base URL from the WebSocket URL
 // ws://host:port/ws → http://host:port
@@ -98,17 +99,8 @@ export function useAgentSession({ projectId, token = '' }) {
   }, []);
 
   // ── Handle incoming WebSocket messages (The Protocol) ────
-  const handleEvent = useCallback(
-    (raw) => {
-      let msg;
-      try {
-        msg = JSON.parse(raw);
-      } catch {
-        // Non-JSON data → treat as terminal output
-        pushLog(raw);
-        return;
-      }
-
+  const dispatchEvent = useCallback(
+    (msg) => {
       switch (msg.type) {
         // ─── Terminal / Docker output ──────────────────
         case 'log':
@@ -155,6 +147,12 @@ export function useAgentSession({ projectId, token = '' }) {
 
         // ─── Agent events (action / state / complete) ─
         case 'agent_event': {
+          // Server-side buffer overflow marker
+          if (msg.event === 'dropped') {
+            pushLog(`… ${msg.count} events elided …`);
+            break;
+          }
+
           const content = msg.content || '';
           const eventType = msg.eventType || msg.event || '';
 
@@ -224,6 +222,29 @@ export function useAgentSession({ projectId, token = '' }) {
     [pushLog, pushMessage]
   );
 
+  const handleEvent = useCallback(
+    (raw) => {
+      const text = typeof raw === 'string' ? raw : frameDecoder.decode(raw);
+      let msg;
+      try {
+        msg = JSON.parse(text);
+      } catch {
+        // Non-JSON data → treat as terminal output
+        pushLog(text);
+        return;
+      }
+
+      // Coalesced burst of agent events → replay one by one
+      if (msg.type === 'agent_event_batch' && Array.isArray(msg.events)) {
+        msg.events.forEach(dispatchEvent);
+        return;
+      }
+
+      dispatchEvent(msg);
+    },
+    [pushLog, dispatchEvent]
+  );
+
   // ── Connect WebSocket ────────────────────────────────────
   const connect = useCallback(
     (initialTask) => {
@@ -244,6 +265,7 @@ export function useAgentSession({ projectId, token = '' }) {
       const url = token ? `${WS_BASE}?token=${token}` : WS_BASE;
 
       const ws = new WebSocket(url);
+      ws.binaryType = 'arraybuffer';
       wsRef.current = ws;
 
       ws.onopen = () => {
@@ -393,8 +415,8 @@ export function useAgentSession({ projectId, token = '' }) {
           throw new Error(err.detail || `HTTP ${res.status}`);
         }
 
-        const data = await res.json();
-        setActiveFile({ path, content: data.content || '', loading: false });
+        const content = await res.text();
+        setActiveFile({ path, content, loading: false });
       } catch (err) {
         pushLog(`⚠️ Failed to read ${path}: ${err.message}`);
         setActiveFile((prev) =>